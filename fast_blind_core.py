@@ -1,7 +1,12 @@
 import os
+import glob
 import time
+from functools import partial
+import numpy as np
 from utils import (
     load_image,
+    load_preview,
+    process_folder_in_parallel,
     save_image,
     calculate_psnr,
     print_blue,
@@ -15,15 +20,23 @@ from image_processing.kernels import (
     kernel_gaussian,
 )
 from image_processing.fast_blind_richardson_lucy import FastBlindRichardsonLucy
+from image_processing.deconvolution_state import find_resumable_state
 
+# Iterations of a blind preview: deblurring even a 256x256 preview with the 120 iterations of the default
+# sweep takes seconds, so longer runs are previewed with fewer iterations
+PREVIEW_MAX_ITERATIONS = 30
 
 class BlindImageProcessor:
-    def __init__(self, input_folder, output_folder):
+    def __init__(self, input_folder, output_folder, checkpoint_interval=10):
         self.input_folder = input_folder
         self.output_folder = output_folder
+        self.checkpoint_interval = checkpoint_interval
 
-    def process_image(self, image_path, kernel_obj, iterations, psf_iterations):
-        image = load_image(image_path)
+    def process_image(
+        self, image_path, kernel_obj, iterations, psf_iterations, image=None
+    ):
+        if image is None:
+            image = load_image(image_path)
         filename = os.path.splitext(os.path.basename(image_path))[0]
         image_output_folder = os.path.join(self.output_folder, filename)
 
@@ -38,7 +51,33 @@ class BlindImageProcessor:
             f"Unblurring image: {filename}, {iterations} iterations, {psf_iterations} PSF iterations"
         )
         start_time = time.time()
-        blrl = FastBlindRichardsonLucy(image, kernel_obj.kernel, iterations, psf_iterations)
+
+        # The state is saved next to the output, so that longer runs (or a run interrupted by a crash)
+        # resume from the most advanced state instead of starting again from iteration 0
+        state_path = os.path.join(
+            kernel_output_folder,
+            f"{filename}_unblurred_{iterations}-iter_{psf_iterations}-psf-iter.npz",
+        )
+        blrl = FastBlindRichardsonLucy(
+            image,
+            kernel_obj.kernel,
+            iterations,
+            psf_iterations,
+            checkpoint_path=state_path,
+            checkpoint_interval=self.checkpoint_interval,
+        )
+        state = find_resumable_state(
+            glob.glob(
+                os.path.join(
+                    kernel_output_folder,
+                    f"{filename}_unblurred_*-iter_{psf_iterations}-psf-iter.npz",
+                )
+            ),
+            iterations,
+            blrl,
+        )
+        if state is not None:
+            print_blue(f"Resuming from {min(state['iterations'])} iterations")
         unblurred_image = blrl.apply()
 
         # Calculate PSNR.
@@ -60,7 +99,186 @@ class BlindImageProcessor:
         print_green(f"Completed in: {duration:.2f} seconds")
         print("")
 
-    def process_folder(self, initial_psf_list, iterations_list, psf_iterations):
+    def process_iterations(
+        self, image_path, kernel_obj, iterations_list, psf_iterations, image=None
+    ):
+        # Runs the iteration counts in order, each one resuming from the state saved by the previous one
+        if image is None:
+            image = load_image(image_path)
+        for iterations in iterations_list:
+            self.process_image(
+                image_path, kernel_obj, iterations, psf_iterations, image
+            )
+
+    def preview(
+        self,
+        image_path,
+        kernel_obj,
+        iterations,
+        psf_iterations,
+        max_size=256,
+        max_iterations=PREVIEW_MAX_ITERATIONS,
+    ):
+        # Low-resolution run to tune the initial PSF and iteration counts: JPEG images are decoded directly at
+        # a reduced scale and the initial PSF is scaled to match (never below 3 pixels, small PSFs preview a
+        # crop instead). Iterations are capped at max_iterations, so that a preview takes well under a second.
+        # Once the preview looks right, the same parameters go to process_image at full resolution.
+        start_time = time.time()
+        image, preview_kernel = load_preview(image_path, kernel_obj, max_size)
+        if iterations > max_iterations:
+            print_yellow(f"Previewing {max_iterations} of the {iterations} iterations")
+            iterations = max_iterations
+
+        filename = os.path.splitext(os.path.basename(image_path))[0]
+        kernel_output_folder = os.path.join(self.output_folder, filename, str(kernel_obj))
+        if not os.path.exists(kernel_output_folder):
+            os.makedirs(kernel_output_folder)
+
+        print_purple(
+            f"Previewing image: {filename} at {image.shape[1]}x{image.shape[0]}, {iterations} iterations, "
+            f"{psf_iterations} PSF iterations, initial PSF scaled to {preview_kernel.size}x{preview_kernel.size}"
+        )
+        blrl = FastBlindRichardsonLucy(
+            image, preview_kernel.kernel, iterations, psf_iterations
+        )
+        unblurred_image = blrl.apply()
+
+        # Calculate PSNR.
+        psnr_value = calculate_psnr(image, unblurred_image)
+        print_yellow(f"PSNR: {psnr_value:.2f} dB")
+
+        duration = time.time() - start_time
+        preview_image_path = os.path.join(
+            kernel_output_folder,
+            f"{filename}_preview_{iterations}-iter_{psf_iterations}-psf-iter.png",
+        )
+        save_image(unblurred_image, preview_image_path)
+
+        print_green(f"Completed in: {duration:.2f} seconds")
+        print("")
+        return unblurred_image
+
+    def search_initial_psf(
+        self, image_path, initial_psf_list, iterations_list, psf_iterations, min_iterations=15
+    ):
+        # Successive halving: every candidate starts with a small budget, the worst half (by data-fidelity
+        # residual) is dropped, and the survivors resume with twice the budget, until a single candidate
+        # gets the largest number of iterations. A single search covers every iteration count: all candidates
+        # still running stop at each requested count on their way, and the best of them is saved there.
+        image = load_image(image_path)
+        filename = os.path.splitext(os.path.basename(image_path))[0]
+        targets = sorted(set(iterations_list))
+        iterations = targets[-1]
+
+        print_purple(
+            f"Searching initial PSF for image: {filename}, {len(initial_psf_list)} candidates, "
+            f"{', '.join(map(str, targets))} iterations, {psf_iterations} PSF iterations"
+        )
+        start_time = time.time()
+        candidates = [
+            (
+                kernel_obj,
+                FastBlindRichardsonLucy(image, kernel_obj.kernel, 0, psf_iterations),
+            )
+            for kernel_obj in initial_psf_list
+        ]
+        budget = min(min_iterations, iterations)
+        completed = 0
+
+        while True:
+            # Run up to the next requested count, or to the end of the current budget
+            stop = min([target for target in targets if target > completed] + [budget])
+            ranking = []
+            for kernel_obj, blrl in candidates:
+                # Survivors resume from their current estimate and PSF
+                blrl.iterations = stop
+                blrl.apply()
+                residual = blrl.residual()
+                print_yellow(f"{kernel_obj}: {stop} iterations, residual {residual:.2f}")
+                ranking.append((residual, kernel_obj, blrl))
+            ranking.sort(key=lambda candidate: candidate[0])
+            completed = stop
+
+            if stop in targets:
+                _, kernel_obj, blrl = ranking[0]
+                unblurred_image = blrl.estimate.astype(np.uint8)
+
+                # Calculate PSNR.
+                psnr_value = calculate_psnr(image, unblurred_image)
+                print_yellow(
+                    f"Best initial PSF at {stop} iterations: {kernel_obj}, PSNR: {psnr_value:.2f} dB"
+                )
+
+                kernel_output_folder = os.path.join(
+                    self.output_folder, filename, str(kernel_obj)
+                )
+                if not os.path.exists(kernel_output_folder):
+                    os.makedirs(kernel_output_folder)
+                unblurred_image_path = os.path.join(
+                    kernel_output_folder,
+                    f"{filename}_unblurred_{stop}-iter_{psf_iterations}-psf-iter.png",
+                )
+                save_image(unblurred_image, unblurred_image_path)
+
+            if stop == iterations:
+                break
+            candidates = [(kernel_obj, blrl) for _, kernel_obj, blrl in ranking]
+            if stop < budget:
+                continue
+            candidates = candidates[: max(1, len(candidates) // 2)]
+            budget = iterations if len(candidates) == 1 else min(2 * budget, iterations)
+
+        duration = time.time() - start_time
+        print_green(f"Completed in: {duration:.2f} seconds")
+        print("")
+
+        return ranking[0][1]
+
+    def process_folder(
+        self,
+        initial_psf_list,
+        iterations_list,
+        psf_iterations,
+        search=False,
+        workers=1,
+        preview=False,
+        memory_budget=None,
+    ):
+        if preview:
+            for filename in os.listdir(self.input_folder):
+                if filename.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")):
+                    print_blue(
+                        f"############### Previewing image: {filename} ###############"
+                    )
+                    image_path = os.path.join(self.input_folder, filename)
+                    # Counts above the cap give the same preview
+                    preview_iterations = sorted(
+                        {min(iterations, PREVIEW_MAX_ITERATIONS) for iterations in iterations_list}
+                    )
+                    for initial_psf in initial_psf_list:
+                        for iterations in preview_iterations:
+                            self.preview(
+                                image_path, initial_psf, iterations, psf_iterations
+                            )
+            return
+
+        if (workers > 1 or memory_budget is not None) and not search:
+            # Every initial PSF runs in its own process, with all its iteration counts, so that each run
+            # resumes from the previous one
+            process_folder_in_parallel(
+                self.input_folder,
+                partial(
+                    self.process_iterations,
+                    iterations_list=iterations_list,
+                    psf_iterations=psf_iterations,
+                ),
+                initial_psf_list,
+                "blind_richardson_lucy",
+                workers,
+                memory_budget,
+            )
+            return
+
         for filename in os.listdir(self.input_folder):
             if filename.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")):
                 print_blue(
@@ -68,11 +286,17 @@ class BlindImageProcessor:
                 )
                 image_path = os.path.join(self.input_folder, filename)
 
+                if search:
+                    # Only the best initial PSF gets the full budget, in one search for all iteration counts
+                    self.search_initial_psf(
+                        image_path, initial_psf_list, iterations_list, psf_iterations
+                    )
+                    continue
+
                 for initial_psf in initial_psf_list:
-                    for iterations in iterations_list:
-                        self.process_image(
-                            image_path, initial_psf, iterations, psf_iterations
-                        )
+                    self.process_iterations(
+                        image_path, initial_psf, iterations_list, psf_iterations
+                    )
 
 
 if __name__ == "__main__":
@@ -96,6 +320,18 @@ if __name__ == "__main__":
         120,
     ]  # Number of iterations for Blind Richardson-Lucy deconvolution
     psf_iterations = 25  # Number of PSF iterations during each main iteration
+    search = False  # Only run the best initial PSF fully, found by successive halving
+    workers = 1  # Number of processes running initial PSFs in parallel
+    preview = False  # Fast low-resolution run, to tune the parameters before the full run
+    memory_budget = None  # Bytes for concurrent jobs, e.g. 4 * 2**30, or None for no limit
 
     processor = BlindImageProcessor(input_folder, output_folder)
-    processor.process_folder(initial_psf_list, iterations_list, psf_iterations)
+    processor.process_folder(
+        initial_psf_list,
+        iterations_list,
+        psf_iterations,
+        search,
+        workers,
+        preview,
+        memory_budget,
+    )
@@ -1,7 +1,11 @@
 import os
+import glob
 import time
+from functools import partial
 from utils import (
     load_image,
+    load_preview,
+    process_folder_in_parallel,
     save_image,
     calculate_psnr,
     print_blue,
@@ -11,18 +15,22 @@ from utils import (
     print_purple,
 )
 from image_processing.kernels import kernel_average, kernel_gaussian
+from image_processing.batch_richardson_lucy import BatchRichardsonLucy
 from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.deconvolution_state import find_resumable_state
 from scipy.signal import convolve2d
 import numpy as np
 
 
 class ImageProcessor:
-    def __init__(self, input_folder, output_folder):
+    def __init__(self, input_folder, output_folder, checkpoint_interval=10):
         self.input_folder = input_folder
         self.output_folder = output_folder
+        self.checkpoint_interval = checkpoint_interval
 
-    def process_image(self, image_path, kernel_obj, iterations_list):
-        image = load_image(image_path)
+    def process_image(self, image_path, kernel_obj, iterations_list, image=None):
+        if image is None:
+            image = load_image(image_path)
         filename = os.path.basename(image_path)
         image_output_folder = os.path.join(
             self.output_folder, os.path.splitext(filename)[0]
@@ -50,7 +58,24 @@ class ImageProcessor:
             print_purple(
                 f"Unblurring image with {kernel_obj} and {iterations} iterations"
             )
-            rl = FastRichardsonLucy(image, kernel_obj.kernel, iterations)
+            # The state is saved next to the output, so that longer runs can resume from it
+            state_path = os.path.join(
+                kernel_output_folder, f"unblurred_{iterations}-iter.npz"
+            )
+            rl = FastRichardsonLucy(
+                image,
+                kernel_obj.kernel,
+                iterations,
+                checkpoint_path=state_path,
+                checkpoint_interval=self.checkpoint_interval,
+            )
+            state = find_resumable_state(
+                glob.glob(os.path.join(kernel_output_folder, "unblurred_*-iter.npz")),
+                iterations,
+                rl,
+            )
+            if state is not None:
+                print_blue(f"Resuming from {min(state['iterations'])} iterations")
             unblurred_image = rl.apply()
 
             # Calculate PSNR.
@@ -66,7 +91,71 @@ class ImageProcessor:
             print_green(f"Completed in: {duration:.2f} seconds")
             print("")
 
-    def process_folder(self, kernels, iterations_list):
+    def preview(self, image_path, kernel_obj, iterations, max_size=256):
+        # Low-resolution run to tune the kernel and iteration count: JPEG images are decoded directly at a
+        # reduced scale, the kernel is scaled to match (never below 3 pixels, small kernels preview a crop
+        # instead), and all channels are deconvolved in one batched FFT. Once the preview looks right, the same
+        # parameters go to process_image at full resolution.
+        start_time = time.time()
+        image, preview_kernel = load_preview(image_path, kernel_obj, max_size)
+
+        filename = os.path.basename(image_path)
+        kernel_output_folder = os.path.join(
+            self.output_folder, os.path.splitext(filename)[0], str(kernel_obj)
+        )
+        if not os.path.exists(kernel_output_folder):
+            os.makedirs(kernel_output_folder)
+
+        print_purple(
+            f"Previewing image at {image.shape[1]}x{image.shape[0]} with {kernel_obj} "
+            f"(scaled to {preview_kernel.size}x{preview_kernel.size}) and {iterations} iterations"
+        )
+        (unblurred_image,) = BatchRichardsonLucy(
+            [image], preview_kernel.kernel, iterations
+        ).apply()
+
+        # Calculate PSNR.
+        psnr_value = calculate_psnr(image, unblurred_image)
+        print_yellow(f"PSNR: {psnr_value:.2f} dB")
+
+        duration = time.time() - start_time
+        preview_image_path = os.path.join(
+            kernel_output_folder, f"preview_{iterations}-iter.png"
+        )
+        save_image(unblurred_image, preview_image_path)
+
+        print_green(f"Completed in: {duration:.2f} seconds")
+        print("")
+        return unblurred_image
+
+    def process_folder(
+        self, kernels, iterations_list, workers=1, preview=False, memory_budget=None
+    ):
+        if preview:
+            for filename in os.listdir(self.input_folder):
+                if filename.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")):
+                    print_blue(
+                        f"############### Previewing image: {filename} ###############"
+                    )
+                    image_path = os.path.join(self.input_folder, filename)
+                    for kernel in kernels:
+                        for iterations in iterations_list:
+                            self.preview(image_path, kernel, iterations)
+            return
+
+        if workers > 1 or memory_budget is not None:
+            # Every kernel runs in its own process, with all its iteration counts, so that each run resumes
+            # from the previous one
+            process_folder_in_parallel(
+                self.input_folder,
+                partial(self.process_image, iterations_list=iterations_list),
+                kernels,
+                "richardson_lucy",
+                workers,
+                memory_budget,
+            )
+            return
+
         for filename in os.listdir(self.input_folder):
             if filename.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")):
                 print_blue(
@@ -100,5 +189,9 @@ if __name__ == "__main__":
 
     iterations_list = [5, 10, 15]
 
+    workers = 1  # Number of processes running kernels in parallel
+    preview = False  # Fast low-resolution run, to tune the kernels and iterations before the full run
+    memory_budget = None  # Bytes for concurrent jobs, e.g. 4 * 2**30, or None for no limit
+
     processor = ImageProcessor(input_folder, output_folder)
-    processor.process_folder(kernels, iterations_list)
+    processor.process_folder(kernels, iterations_list, workers, preview, memory_budget)
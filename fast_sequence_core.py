@@ -0,0 +1,83 @@
+import os
+import time
+from utils import (
+    load_image,
+    save_image,
+    calculate_psnr,
+    print_blue,
+    print_green,
+    print_yellow,
+    print_purple,
+)
+from image_processing.kernels import kernel_gaussian
+from image_processing.sequence_deconvolution import SequenceRichardsonLucy
+
+
+class SequenceProcessor:
+    def __init__(self, input_folder, output_folder):
+        self.input_folder = input_folder
+        self.output_folder = output_folder
+
+    def process_sequence(
+        self, kernel_obj, iterations, warm_iterations, psf_iterations=None
+    ):
+        # Frames are processed in filename order, so they should be numbered (e.g. frame_0001.png)
+        filenames = sorted(
+            filename
+            for filename in os.listdir(self.input_folder)
+            if filename.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif"))
+        )
+
+        kernel_output_folder = os.path.join(self.output_folder, str(kernel_obj))
+        if not os.path.exists(kernel_output_folder):
+            os.makedirs(kernel_output_folder)
+
+        print_blue(
+            f"############### Processing {len(filenames)} frames with {kernel_obj} ###############"
+        )
+        sequence = SequenceRichardsonLucy(
+            kernel_obj.kernel, iterations, warm_iterations, psf_iterations
+        )
+        sequence_start_time = time.time()
+
+        for index, filename in enumerate(filenames):
+            frame = load_image(os.path.join(self.input_folder, filename))
+            frame_iterations = iterations if index == 0 else warm_iterations
+            print_purple(f"Unblurring frame: {filename}, {frame_iterations} iterations")
+
+            start_time = time.time()
+            unblurred_frame = sequence.process_frame(frame)
+
+            # Calculate PSNR.
+            psnr_value = calculate_psnr(frame, unblurred_frame)
+            print_yellow(f"PSNR: {psnr_value:.2f} dB")
+
+            duration = time.time() - start_time
+            unblurred_frame_path = os.path.join(
+                kernel_output_folder,
+                f"{os.path.splitext(filename)[0]}_unblurred.png",
+            )
+            save_image(unblurred_frame, unblurred_frame_path)
+            print_green(f"Completed in: {duration:.2f} seconds")
+
+        total_duration = time.time() - sequence_start_time
+        if filenames:
+            print_green(
+                f"Sequence completed in: {total_duration:.2f} seconds "
+                f"({len(filenames) / total_duration:.2f} frames/s)"
+            )
+        print("")
+
+
+if __name__ == "__main__":
+    input_folder = "images/sequence_originals"
+    output_folder = "images/sequence_processed"
+
+    kernel = kernel_gaussian(5, 1.0)
+
+    iterations = 30  # Iterations for the first frame
+    warm_iterations = 10  # Iterations for the following, warm-started frames
+    psf_iterations = None  # Set to a number of PSF iterations to run blind
+
+    processor = SequenceProcessor(input_folder, output_folder)
+    processor.process_sequence(kernel, iterations, warm_iterations, psf_iterations)
@@ -0,0 +1,32 @@
+import time
+from utils import print_blue, print_green, print_yellow
+from image_processing.deblur_service import DeblurService
+
+
+if __name__ == "__main__":
+    host = "127.0.0.1"  # Only reachable from this machine
+    port = 8765
+
+    batch_window = 0.02  # Seconds a request waits for others with the same shape and kernel
+    max_batch_size = 8
+    max_pending = 32  # Further requests are rejected with HTTP 503 until the queue drains
+    stats_interval = 60  # Seconds between two statistics reports
+
+    service = DeblurService(host, port, batch_window, max_batch_size, max_pending)
+    service.start()
+    print_green(f"Deblur service listening on http://{host}:{port}")
+    print_blue(
+        f"POST http://{host}:{port}/deblur?algorithm=richardson_lucy&kernel=gaussian&size=5&sigma=1.0&iterations=10"
+    )
+
+    try:
+        while True:
+            time.sleep(stats_interval)
+            stats = service.stats()
+            print_yellow(
+                f"{stats['completed']} completed, {stats['rejected']} rejected, {stats['pending']} pending, "
+                f"mean batch size {stats['mean_batch_size']:.1f}, {stats['throughput']:.2f} requests/s, "
+                f"p95 latency {stats.get('latency_p95', 0.0):.3f} s"
+            )
+    except KeyboardInterrupt:
+        service.stop()
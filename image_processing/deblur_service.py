@@ -0,0 +1,517 @@
+import io
+import json
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+from image_processing.batch_richardson_lucy import BatchRichardsonLucy
+from image_processing.fast_blind_richardson_lucy import FastBlindRichardsonLucy
+from image_processing.fft_backend import get_fft_backend, psf_to_otf
+from image_processing.kernels import (
+    kernel_average,
+    kernel_disk,
+    kernel_gaussian,
+    kernel_motion,
+)
+from image_processing.wiener import FastWiener
+
+ALGORITHMS = ("richardson_lucy", "blind_richardson_lucy", "wiener")
+
+_kernel_factories = {
+    "average": kernel_average,
+    "gaussian": kernel_gaussian,
+    "motion": kernel_motion,
+    "disk": kernel_disk,
+}
+
+# Request parameters and their types, as they arrive as strings in the query
+_parameter_types = {
+    "iterations": int,
+    "psf_iterations": int,
+    "balance": float,
+    "size": int,
+    "sigma": float,
+    "length": int,
+    "angle": float,
+    "radius": float,
+}
+
+
+class ServiceBusyError(RuntimeError):
+    """
+    Raised when the deblur service already holds its maximum number of pending requests.
+    """
+
+
+class DeblurService:
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8765,
+        batch_window=0.02,
+        max_batch_size=8,
+        max_pending=32,
+        cache_size=32,
+        fft_backend=None,
+        threads=1,
+    ):
+        """
+        Initializes a long-lived local deblur service. It keeps the FFT backend (and its pyfftw plans), the kernels
+        and their OTFs warm across requests, and serves them over HTTP:
+
+            POST /deblur?algorithm=richardson_lucy&kernel=gaussian&size=5&sigma=1.0&iterations=10
+                The body is an image file (PNG, JPEG...) or a .npy array, the response a .npy array.
+            GET /stats
+                Queue depth, batching, latency and throughput statistics, as JSON.
+
+        Requests with the same algorithm, parameters, kernel and image shape that arrive within `batch_window`
+        seconds of each other are coalesced into one batched run: the Richardson-Lucy and Wiener deconvolutions
+        of the whole batch share one OTF and run as stacked FFTs. Blind requests of a batch share the OTF cache
+        and FFT plans but run one after another, since each refines its own PSF.
+
+        When `max_pending` requests are waiting, new ones are rejected (HTTP 503 with a Retry-After header)
+        instead of queuing without bound.
+
+        :param host: The interface to listen on, defaults to localhost only.
+        :type host: str
+        :param port: The port to listen on, defaults to 8765. Use 0 to pick a free port, see `address`.
+        :type port: int
+        :param batch_window: How long, in seconds, a request waits for others to join its batch, defaults to 0.02.
+        :type batch_window: float
+        :param max_batch_size: Maximum number of requests in a batch, defaults to 8.
+        :type max_batch_size: int
+        :param max_pending: Maximum number of requests waiting or running, defaults to 32.
+        :type max_pending: int
+        :param cache_size: Maximum number of OTFs kept in cache, defaults to 32.
+        :type cache_size: int
+        :param fft_backend: The FFT backend, from `image_processing.fft_backend`. Defaults to `get_fft_backend()`.
+        :param threads: Number of threads each blind deconvolution uses for its channels, defaults to 1.
+        :type threads: int
+        """
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_pending = max_pending
+        self.cache_size = cache_size
+        self.fft_backend = fft_backend if fft_backend is not None else get_fft_backend()
+        self.threads = threads
+
+        self._server = None
+        self._threads = []
+        self._running = False
+        self._condition = threading.Condition()
+        self._queue = []  # Requests waiting for a batch, oldest first
+        self._pending = 0  # Requests waiting or running
+
+        self._kernels = {}
+        self._otfs = OrderedDict()
+
+        self._started_at = None
+        self._counters = {
+            "requests": 0,
+            "completed": 0,
+            "failed": 0,
+            "rejected": 0,
+            "batches": 0,
+        }
+        self._latencies = deque(maxlen=1000)  # Seconds, of the most recent requests
+
+    @property
+    def address(self):
+        """
+        The (host, port) the service listens on, once started.
+        """
+        return self._server.server_address[:2]
+
+    def start(self):
+        """
+        Starts the HTTP server and the batching thread in the background.
+
+        :return: The service itself.
+        :rtype: DeblurService
+        """
+        self._server = ThreadingHTTPServer((self.host, self.port), _DeblurRequestHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._running = True
+        self._started_at = time.perf_counter()
+
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, daemon=True),
+            threading.Thread(target=self._dispatch, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the HTTP server and the batching thread. Requests still waiting for a batch fail.
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def submit(
+        self,
+        image,
+        algorithm="richardson_lucy",
+        kernel="gaussian",
+        iterations=10,
+        psf_iterations=5,
+        balance=0.01,
+        **kernel_parameters,
+    ):
+        """
+        Deblurs an image, possibly in a batch with concurrent requests, and waits for the result.
+
+        :param image: The blurry image, as a 2D (grayscale) or 3D (color) numpy array.
+        :type image: numpy.ndarray
+        :param algorithm: One of "richardson_lucy", "blind_richardson_lucy" or "wiener".
+        :type algorithm: str
+        :param kernel: The kernel (or initial PSF guess in blind mode): "average", "gaussian", "motion" or "disk".
+        :type kernel: str
+        :param iterations: The number of Richardson-Lucy iterations, defaults to 10.
+        :type iterations: int
+        :param psf_iterations: The number of PSF refinement iterations in blind mode, defaults to 5.
+        :type psf_iterations: int
+        :param balance: The regularization weight of the Wiener deconvolution, defaults to 0.01.
+        :type balance: float
+        :param kernel_parameters: The parameters of the kernel function, e.g. size=5, sigma=1.0.
+        :return: The deblurred image.
+        :rtype: numpy.ndarray
+        :raises ValueError: If the algorithm, kernel or image is invalid.
+        :raises ServiceBusyError: If too many requests are already pending.
+        """
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown algorithm: {algorithm}.")
+        if image.ndim not in (2, 3) or (image.ndim == 3 and image.shape[2] != 3):
+            raise ValueError("The image must be grayscale or RGB.")
+        kernel_obj = self._kernel(kernel, kernel_parameters)
+
+        # Only the parameters used by the algorithm tell batches apart
+        if algorithm == "wiener":
+            settings = (balance,)
+        elif algorithm == "blind_richardson_lucy":
+            settings = (iterations, psf_iterations)
+        else:
+            settings = (iterations,)
+        job = _DeblurJob(
+            (algorithm, settings, str(kernel_obj), image.shape), image, kernel_obj
+        )
+
+        with self._condition:
+            self._counters["requests"] += 1
+            if not self._running:
+                raise RuntimeError("The deblur service is not running.")
+            if self._pending >= self.max_pending:
+                self._counters["rejected"] += 1
+                raise ServiceBusyError("Too many pending requests, retry later.")
+            self._pending += 1
+            self._queue.append(job)
+            self._condition.notify_all()
+
+        job.done.wait()
+        with self._condition:
+            self._pending -= 1
+            if job.error is None:
+                self._counters["completed"] += 1
+                self._latencies.append(time.perf_counter() - job.submitted_at)
+            else:
+                self._counters["failed"] += 1
+
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stats(self):
+        """
+        Gathers the statistics of the service.
+
+        :return: The request counters, current queue depth, mean batch size, latency percentiles (in seconds,
+            over the last 1000 requests) and throughput (completed requests per second since the start).
+        :rtype: dict
+        """
+        with self._condition:
+            stats = dict(self._counters)
+            stats["pending"] = self._pending
+            stats["queued"] = len(self._queue)
+            latencies = np.array(self._latencies)
+
+        uptime = time.perf_counter() - self._started_at if self._started_at else 0.0
+        stats["uptime"] = uptime
+        stats["throughput"] = stats["completed"] / uptime if uptime > 0 else 0.0
+        stats["mean_batch_size"] = (
+            stats["completed"] / stats["batches"] if stats["batches"] else 0.0
+        )
+        if len(latencies):
+            stats["latency_p50"] = float(np.percentile(latencies, 50))
+            stats["latency_p95"] = float(np.percentile(latencies, 95))
+            stats["latency_max"] = float(latencies.max())
+        return stats
+
+    def _dispatch(self):
+        """
+        Batching loop: waits for the oldest request, lets compatible requests join it during the batch window,
+        then runs them together.
+        """
+        while True:
+            with self._condition:
+                while self._running and not self._queue:
+                    self._condition.wait()
+                if not self._running:
+                    break
+
+                key = self._queue[0].key
+                deadline = self._queue[0].submitted_at + self.batch_window
+                while self._running:
+                    batch_size = sum(job.key == key for job in self._queue)
+                    remaining = deadline - time.perf_counter()
+                    if batch_size >= self.max_batch_size or remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+
+                batch = [job for job in self._queue if job.key == key]
+                batch = batch[: self.max_batch_size]
+                self._queue = [job for job in self._queue if job not in batch]
+                self._counters["batches"] += 1
+
+            self._run_batch(batch)
+
+        # Fail the requests that never got a batch
+        with self._condition:
+            for job in self._queue:
+                job.error = RuntimeError("The deblur service stopped.")
+                job.done.set()
+            self._queue = []
+
+    def _run_batch(self, batch):
+        """
+        Deblurs a batch of requests sharing the same algorithm, parameters, kernel and image shape.
+
+        :param batch: The requests.
+        :type batch: list
+        """
+        algorithm, settings, _, shape = batch[0].key
+        kernel_obj = batch[0].kernel_obj
+        images = [job.image for job in batch]
+
+        try:
+            if algorithm == "richardson_lucy":
+                (iterations,) = settings
+                results = BatchRichardsonLucy(
+                    images,
+                    kernel_obj.kernel,
+                    iterations,
+                    otf=self._otf(kernel_obj, shape),
+                    fft_backend=self.fft_backend,
+                ).apply()
+            elif algorithm == "wiener":
+                (balance,) = settings
+                # The batch is filtered at once, as a single image with the channels of every image
+                channels = 1 if len(shape) == 2 else shape[2]
+                stack = np.concatenate([np.atleast_3d(image) for image in images], axis=2)
+                deblurred = FastWiener(
+                    stack,
+                    kernel_obj,
+                    balance,
+                    fft_backend=self.fft_backend,
+                    otf=self._otf(kernel_obj, shape),
+                ).apply()
+                results = [
+                    deblurred[:, :, i * channels : (i + 1) * channels].reshape(shape)
+                    for i in range(len(images))
+                ]
+            else:
+                iterations, psf_iterations = settings
+                results = [
+                    FastBlindRichardsonLucy(
+                        image,
+                        kernel_obj.kernel,
+                        iterations,
+                        psf_iterations,
+                        fft_backend=self.fft_backend,
+                        threads=self.threads,
+                    ).apply()
+                    for image in images
+                ]
+        except Exception as error:
+            for job in batch:
+                job.error = error
+                job.done.set()
+            return
+
+        for job, result in zip(batch, results):
+            job.result = result
+            job.done.set()
+
+    def _kernel(self, name, parameters):
+        """
+        Returns the cached kernel built from a kernel function and its parameters.
+
+        :param name: The kernel name, a key of `_kernel_factories`.
+        :type name: str
+        :param parameters: The parameters of the kernel function.
+        :type parameters: dict
+        :return: The kernel.
+        :rtype: Kernel
+        :raises ValueError: If the kernel or its parameters are invalid.
+        """
+        if name not in _kernel_factories:
+            raise ValueError(f"Unknown kernel: {name}.")
+        key = (name, tuple(sorted(parameters.items())))
+        if key not in self._kernels:
+            try:
+                self._kernels[key] = _kernel_factories[name](**parameters)
+            except TypeError as error:
+                raise ValueError(f"Invalid parameters for kernel {name}: {error}.")
+        return self._kernels[key]
+
+    def _otf(self, kernel_obj, shape):
+        """
+        Returns the cached OTF of a kernel for an image shape, computing it on first use. Only the batching
+        thread calls it.
+
+        The OTF is always the one of the kernel matrix, which both Richardson-Lucy and Wiener deconvolve, and
+        which the analytic OTFs of the motion and disk kernels only approximate.
+
+        :param kernel_obj: The kernel.
+        :type kernel_obj: Kernel
+        :param shape: The shape of the image.
+        :type shape: tuple
+        :return: The OTF, as a half spectrum.
+        :rtype: numpy.ndarray
+        """
+        key = (str(kernel_obj), shape[:2])
+        if key in self._otfs:
+            self._otfs.move_to_end(key)
+        else:
+            self._otfs[key] = psf_to_otf(kernel_obj.kernel, shape[:2], self.fft_backend)
+            if len(self._otfs) > self.cache_size:
+                self._otfs.popitem(last=False)
+        return self._otfs[key]
+
+
+class _DeblurJob:
+    def __init__(self, key, image, kernel_obj):
+        """
+        A request waiting for its batch.
+
+        :param key: The requests sharing this key can be batched together.
+        :type key: tuple
+        :param image: The blurry image.
+        :type image: numpy.ndarray
+        :param kernel_obj: The kernel.
+        :type kernel_obj: Kernel
+        """
+        self.key = key
+        self.image = image
+        self.kernel_obj = kernel_obj
+        self.submitted_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _DeblurRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path != "/stats":
+            self._send(404, b"Not found.", "text/plain")
+            return
+        stats = self.server.service.stats()
+        self._send(200, json.dumps(stats).encode(), "application/json")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/deblur":
+            self._send(404, b"Not found.", "text/plain")
+            return
+
+        try:
+            parameters = {}
+            for name, value in urllib.parse.parse_qsl(url.query):
+                parameters[name] = _parameter_types.get(name, str)(value)
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            image = _decode_image(body)
+            result = self.server.service.submit(image, **parameters)
+        except ServiceBusyError as error:
+            self._send(503, str(error).encode(), "text/plain", {"Retry-After": "1"})
+            return
+        except (ValueError, TypeError, OSError) as error:
+            self._send(400, str(error).encode(), "text/plain")
+            return
+        except Exception as error:
+            self._send(500, str(error).encode(), "text/plain")
+            return
+
+        buffer = io.BytesIO()
+        np.save(buffer, result, allow_pickle=False)
+        self._send(200, buffer.getvalue(), "application/octet-stream")
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are accounted for in the statistics instead of logged one by one
+        pass
+
+
+def _decode_image(body):
+    """
+    Decodes the body of a request: a .npy array, or an image file in any format Pillow reads.
+
+    :param body: The request body.
+    :type body: bytes
+    :return: The image, as a 2D (grayscale) or 3D (RGB) numpy array.
+    :rtype: numpy.ndarray
+    """
+    if body.startswith(b"\x93NUMPY"):
+        return np.load(io.BytesIO(body), allow_pickle=False)
+    image = Image.open(io.BytesIO(body))
+    if image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+    return np.array(image)
+
+
+def request_deblur(url, image, **parameters):
+    """
+    Sends an image to a running deblur service and returns the result.
+
+        deblurred_image = request_deblur("http://127.0.0.1:8765", image, kernel="gaussian", size=5, sigma=1.0)
+
+    :param url: The base URL of the service.
+    :type url: str
+    :param image: The blurry image, as a numpy array.
+    :type image: numpy.ndarray
+    :param parameters: The parameters of `DeblurService.submit`, e.g. algorithm, kernel, iterations, size.
+    :return: The deblurred image.
+    :rtype: numpy.ndarray
+    :raises urllib.error.HTTPError: If the service rejects the request (status 503 when it is busy).
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, image, allow_pickle=False)
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/deblur?{urllib.parse.urlencode(parameters)}",
+        data=buffer.getvalue(),
+        headers={"Content-Type": "application/octet-stream"},
+        method="POST",
+    )
+    with urllib.request.urlopen(request) as response:
+        return np.load(io.BytesIO(response.read()), allow_pickle=False)
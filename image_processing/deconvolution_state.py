@@ -0,0 +1,77 @@
+import os
+import zipfile
+import numpy as np
+
+
+def save_state(file_path, state):
+    """
+    Saves a deconvolution state, as returned by `export_state`, to a compressed .npz file.
+
+    The file is written next to its destination first and then moved in place, so an interrupted save never
+    leaves a truncated state behind.
+
+    :param file_path: The path where the state will be saved.
+    :type file_path: str
+    :param state: The deconvolution state, a dictionary of numpy arrays.
+    :type state: dict
+    """
+    temporary_path = file_path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        np.savez_compressed(file, **state)
+    os.replace(temporary_path, file_path)
+
+
+def load_state(file_path):
+    """
+    Loads a deconvolution state saved with `save_state`.
+
+    :param file_path: The path of the saved state.
+    :type file_path: str
+    :return: The deconvolution state, a dictionary of numpy arrays.
+    :rtype: dict
+    """
+    with np.load(file_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def find_resumable_state(file_paths, iterations, deconvolver=None):
+    """
+    Finds the most advanced saved state that a run of `iterations` iterations can resume from, i.e. the one
+    with the most completed iterations that does not exceed `iterations` on any channel.
+
+    Unreadable files, such as a state whose save was interrupted by a crash, are ignored. When a deconvolver is
+    given, so are the states its `import_state` rejects, e.g. a state computed for another image or PSF, and the
+    state found is imported into it.
+
+    :param file_paths: The paths of the candidate state files.
+    :type file_paths: list
+    :param iterations: The number of iterations requested for the new run.
+    :type iterations: int
+    :param deconvolver: Optional deconvolver to resume, e.g. a `FastRichardsonLucy`. Defaults to None.
+    :return: The state to resume from, or None if no state fits.
+    :rtype: dict
+    """
+    states = []
+    for file_path in file_paths:
+        try:
+            state = load_state(file_path)
+            completed_iterations = state["iterations"]
+        except (OSError, ValueError, EOFError, KeyError, zipfile.BadZipFile):
+            continue
+
+        if np.max(completed_iterations) > iterations:
+            continue
+        states.append(state)
+
+    # Most advanced first
+    states.sort(key=lambda state: np.sum(state["iterations"]), reverse=True)
+    for state in states:
+        if deconvolver is None:
+            return state
+        try:
+            deconvolver.import_state(state)
+        except (ValueError, KeyError):
+            continue
+        return state
+
+    return None
@@ -1,9 +1,27 @@
+import threading
 import numpy as np
-from scipy.signal import fftconvolve
+from concurrent.futures import ThreadPoolExecutor
+from image_processing.fft_backend import get_fft_backend, convolve_wrap
+from image_processing.deconvolution_state import save_state
+from image_processing.kernels import Kernel, scale_kernel
+from image_processing.roi import roi_halo, deconvolve_rois
 
 
 class FastBlindRichardsonLucy:
-    def __init__(self, image, initial_psf, iterations=10, psf_iterations=5):
+    def __init__(
+        self,
+        image,
+        initial_psf,
+        iterations=10,
+        psf_iterations=5,
+        initial_estimate=None,
+        checkpoint_path=None,
+        checkpoint_interval=None,
+        fft_backend=None,
+        threads=1,
+        correction_factors=None,
+        channel_psfs=None,
+    ):
         """
         Initialize the BlindRichardsonLucy deconvolution class with the target image,
         an initial point spread function (PSF), and the number of iterations for both
@@ -13,62 +31,360 @@ class FastBlindRichardsonLucy:
         :param initial_psf: Initial guess for the point spread function.
         :param iterations: Number of iterations for the deconvolution process.
         :param psf_iterations: Number of iterations for refining the PSF.
+        :param initial_estimate: Optional starting image estimate, e.g. the result of a previous frame.
+        :param checkpoint_path: Optional .npz path where the state is saved while running.
+        :param checkpoint_interval: Number of iterations between two checkpoints. Defaults to None, which only
+            saves once each channel is done.
+        :param fft_backend: FFT backend used for the convolutions, from `image_processing.fft_backend`.
+            Defaults to `get_fft_backend()`, which uses every core, or a single core per transform when channels
+            run in threads, so that the threads do not oversubscribe the machine.
+        :param threads: Number of channels deconvolved concurrently inside `apply`, defaults to 1. With more than
+            one thread, the channels iterate from the same PSF and then refine it one after another, whereas a
+            single thread refines it between channels, so the results differ slightly.
+        :param correction_factors: Optional lighting and contrast correction factors, of shape (channels,
+            iterations), applied instead of the ones measured on the image, e.g. the ones of the whole image when
+            deconvolving a region of it.
+        :param channel_psfs: Optional PSFs each channel is deconvolved with, of shape (channels,) + PSF shape,
+            instead of the PSF refined by the previous channels, e.g. the ones of the whole image when
+            deconvolving a region of it.
         """
         self.image = image.astype(np.float64)
-        self.psf = initial_psf
+        # Own a copy of the PSF: it is refined in place and must not leak into the caller's kernel
+        self.psf = np.array(initial_psf, dtype=np.float64)
         self.iterations = iterations
         self.psf_iterations = psf_iterations
         self.psf_mirror = np.flipud(np.fliplr(self.psf))  # Precompute the mirrored PSF
+        self.initial_estimate = initial_estimate
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.threads = threads
+        self.correction_factors = correction_factors
+        self.given_channel_psfs = channel_psfs
+        if fft_backend is None:
+            # Concurrent channels already use the cores, so each transform stays on one
+            channel_threads = min(threads, image.shape[2] if image.ndim == 3 else 1)
+            fft_backend = get_fft_backend(workers=1 if channel_threads > 1 else None)
+        self.fft_backend = fft_backend
+
+        # Deconvolution state: current estimate, completed iterations and lighting statistics, per channel
+        self.estimate = None
+        self.completed_iterations = None
+        channels = self._channels(self.image)
+        self.original_mean = np.array([np.mean(channel) for channel in channels])
+        self.original_std = np.array([np.std(channel) for channel in channels])
+        # Lighting and contrast correction factor applied at each iteration, per channel (NaN when skipped), and
+        # the PSF each channel was deconvolved with (NaN for channels resumed with no iteration left)
+        self.corrections = np.full((len(channels), iterations), np.nan)
+        self.channel_psfs = np.full((len(channels),) + self.psf.shape, np.nan)
+        # Guards the state while concurrent channels update and save it
+        self._state_lock = threading.Lock()
 
     def apply(self):
         """
         Deblurs the image using the Richardson-Lucy deconvolution algorithm. This method supports both grayscale
         and color images by processing each channel separately if necessary.
 
+        If a state was imported, the deconvolution resumes from it: channels run their missing iterations
+        from the saved estimate and PSF, then refine the PSF again.
+
         :return: The deblurred image, with the same dimensions as the input image.
         :rtype: numpy.ndarray
         """
-        if self.image.ndim == 3:
-            channels = [self._apply_to_channel(self.image[:, :, i]) for i in range(3)]
-            deblurred_image = np.stack(channels, axis=-1)
+        if self.estimate is None:
+            self._initialize_state()
+
+        indices = range(len(self.completed_iterations))
+        if self.threads > 1 and len(indices) > 1:
+            with ThreadPoolExecutor(max_workers=min(self.threads, len(indices))) as executor:
+                estimates = list(executor.map(self._iterate_channel, indices))
+            # The PSF is refined with each channel in turn, like in the sequential run
+            for index, estimate in zip(indices, estimates):
+                self._finish_channel(index, estimate)
         else:
-            deblurred_image = self._apply_to_channel(self.image)
-        return deblurred_image.astype(np.uint8)
+            for index in indices:
+                self._apply_to_channel(index)
+
+        return self.estimate.astype(np.uint8)
+
+    def apply_rois(self, boxes, correction_factors=None, channel_psfs=None):
+        """
+        Deblur only some regions of interest of the image. Each region is deconvolved with a halo sized
+        from the PSF radius and the number of iterations; `self.psf` is left untouched.
+
+        Pixels inside a region only depend on pixels within the halo, except through the lighting and contrast
+        correction, whose factors are measured on the whole image at each iteration, and through the PSF, which
+        is refined from the whole image between channels. The regions are therefore deconvolved with the factors
+        of the whole image: either `correction_factors`, e.g. the `corrections` of a full-frame run, or factors
+        estimated by a full-frame run at half resolution. Each region refines its own copy of the PSF between
+        channels, unless `channel_psfs` are given, e.g. the `channel_psfs` of a full-frame run. With both, the
+        result is the same as a full-frame run up to floating-point rounding; with the estimated factors, it
+        matches a full-frame run within about 0.5 gray levels on average and 5 at most inside the regions.
+        Kernels smaller than 5 pixels would shrink to about a single pixel at half resolution, so the whole
+        image is deconvolved instead.
+
+        :param boxes: Regions of interest, as (left, upper, right, lower) tuples.
+        :param correction_factors: Optional lighting and contrast correction factors of the whole image, of
+            shape (channels, iterations). Defaults to None, which estimates them.
+        :param channel_psfs: Optional PSFs each channel of the whole image was deconvolved with, of shape
+            (channels,) + PSF shape. Defaults to None, which refines the PSF from each region.
+        :return: A copy of the image where the regions of interest are deblurred.
+        """
+        halo = roi_halo(self.psf.shape, self.iterations)
+        if correction_factors is None and min(self.psf.shape) < 5:
+            # A halo as large as the image makes deconvolve_rois deconvolve the whole image, once
+            halo = max(self.image.shape[:2])
+
+        factors = [correction_factors]
+
+        def deconvolve(crop):
+            if crop is self.image:
+                # The halo covers the whole image, which measures its own factors and refines its own PSF
+                blrl = self._region_deconvolver(crop, None, channel_psfs)
+            else:
+                if factors[0] is None:
+                    factors[0] = self._half_resolution_corrections()
+                blrl = self._region_deconvolver(crop, factors[0], channel_psfs)
+            blrl.apply()
+            return blrl.estimate
+
+        return deconvolve_rois(self.image, boxes, halo, deconvolve).astype(np.uint8)
+
+    def residual(self):
+        """
+        Compute the data-fidelity residual of the current estimate: the mean squared difference between the
+        image and the estimate blurred by the current PSF. Lower is better, which allows ranking runs started
+        from different initial PSFs.
+
+        :return: The residual, averaged over pixels and channels.
+        :rtype: float
+        """
+        if self.estimate is None:
+            self._initialize_state()
+
+        channels = self._channels(self.image)
+        estimates = self._channels(self.estimate)
+        return float(
+            np.mean(
+                [
+                    np.mean((channel - self._convolve2d(estimate, self.psf)) ** 2)
+                    for channel, estimate in zip(channels, estimates)
+                ]
+            )
+        )
+
+    def export_state(self):
+        """
+        Export the full deconvolution state, to be saved with
+        `image_processing.deconvolution_state.save_state` and resumed later.
 
-    def _apply_to_channel(self, channel):
+        :return: The current estimate, PSF, completed iterations per channel and lighting statistics.
+        """
+        if self.estimate is None:
+            self._initialize_state()
+        return {key: np.copy(value) for key, value in self._state().items()}
+
+    def import_state(self, state):
+        """
+        Import a deconvolution state exported by `export_state`, including its refined PSF.
+        The next call to `apply` resumes from it.
+
+        :param state: The deconvolution state.
+        :raises ValueError: If the state was computed for another image, or with more iterations than requested.
+        """
+        if state["estimate"].shape != self.image.shape:
+            raise ValueError("State does not match the image shape.")
+        if not np.allclose(state["original_mean"], self.original_mean) or not np.allclose(
+            state["original_std"], self.original_std
+        ):
+            raise ValueError("State was computed for another image.")
+        if np.max(state["iterations"]) > self.iterations:
+            raise ValueError("State has more iterations than requested.")
+
+        self.estimate = np.array(state["estimate"], dtype=np.float64)
+        self.completed_iterations = np.array(state["iterations"], dtype=np.int64)
+        self.psf = np.array(state["psf"], dtype=np.float64)
+        self.psf_mirror = np.flipud(np.fliplr(self.psf))
+
+    def _region_deconvolver(self, image, correction_factors, channel_psfs):
+        """
+        Create the deconvolver of a region of interest, with the settings of this one. Given PSFs are not
+        refined again, since only the estimate of the region is kept.
+
+        :param image: The region and its halo.
+        :param correction_factors: The lighting and contrast correction factors of the whole image, or None.
+        :param channel_psfs: The PSFs of the channels of the whole image, or None.
+        :return: The deconvolver.
+        """
+        return FastBlindRichardsonLucy(
+            image,
+            self.psf,
+            self.iterations,
+            self.psf_iterations if channel_psfs is None else 0,
+            fft_backend=self.fft_backend,
+            threads=self.threads,
+            correction_factors=correction_factors,
+            channel_psfs=channel_psfs,
+        )
+
+    def _half_resolution_corrections(self):
+        """
+        Estimate the lighting and contrast correction factors of a full-frame run with a full-frame run at half
+        resolution, on the image averaged over blocks of 2x2 pixels and the PSF scaled accordingly.
+
+        :return: The correction factors, of shape (channels, iterations).
+        """
+        height, width = self.image.shape[0] // 2, self.image.shape[1] // 2
+        image = self.image[: 2 * height, : 2 * width]
+        image = image.reshape((height, 2, width, 2) + image.shape[2:]).mean(axis=(1, 3))
+        psf = scale_kernel(Kernel("psf", self.psf, max(self.psf.shape)), 0.5).kernel
+
+        blrl = FastBlindRichardsonLucy(
+            image,
+            psf,
+            self.iterations,
+            self.psf_iterations,
+            fft_backend=self.fft_backend,
+            threads=self.threads,
+        )
+        blrl.apply()
+        return blrl.corrections
+
+    def _apply_to_channel(self, index):
         """
         Apply the deconvolution process to a single color channel and updates the PSF estimate.
+        Only the iterations this channel is still missing are run, and the PSF is left untouched
+        if there are none.
 
-        :param channel: Single color channel of the image as a numpy array.
-        :return: Deconvolved channel as a numpy array.
+        :param index: Index of the color channel to process.
         """
-        original_mean = np.mean(channel)
-        original_std = np.std(channel)
+        self._finish_channel(index, self._iterate_channel(index))
 
-        estimate = np.copy(channel)
+    def _iterate_channel(self, index):
+        """
+        Run the Richardson-Lucy iterations a single color channel is still missing, with the current PSF.
 
-        for _ in range(self.iterations):
-            convolved_estimate = self._convolve2d(estimate, self.psf)
+        :param index: Index of the color channel to process.
+        :return: The new estimate of the channel, or None if it had no iterations left.
+        """
+        channel = self._channels(self.image)[index]
+        completed_iterations = self.completed_iterations[index]
+        if completed_iterations >= self.iterations:
+            return None
+
+        original_mean = self.original_mean[index]
+        original_std = self.original_std[index]
+
+        estimate = np.copy(self._channels(self.estimate)[index])
+        if self.given_channel_psfs is not None:
+            psf = np.asarray(self.given_channel_psfs[index], dtype=np.float64)
+            psf_mirror = np.flipud(np.fliplr(psf))
+        else:
+            psf, psf_mirror = self.psf, self.psf_mirror
+        self.channel_psfs[index] = psf
+
+        while completed_iterations < self.iterations:
+            convolved_estimate = self._convolve2d(estimate, psf)
             relative_blur = channel / (convolved_estimate + 1e-12)
-            error_estimate = self._convolve2d(relative_blur, self.psf_mirror)
+            error_estimate = self._convolve2d(relative_blur, psf_mirror)
             estimate *= error_estimate
 
             # Incremental lighting and contrast correction
-            estimate_mean = np.mean(estimate)
-            estimate_std = np.std(estimate)
+            if self.correction_factors is not None:
+                correction_factor = self.correction_factors[index][completed_iterations]
+            else:
+                estimate_mean = np.mean(estimate)
+                estimate_std = np.std(estimate)
+                correction_factor = np.nan
+                if estimate_mean > 0 and estimate_std > 0:
+                    mean_correction_factor = original_mean / estimate_mean
+                    std_correction_factor = original_std / estimate_std
+                    correction_factor = mean_correction_factor * std_correction_factor
 
-            if estimate_mean > 0 and estimate_std > 0:
-                mean_correction_factor = original_mean / estimate_mean
-                std_correction_factor = original_std / estimate_std
-                estimate = (estimate * mean_correction_factor) * std_correction_factor
+            if not np.isnan(correction_factor):
+                estimate = estimate * correction_factor
                 # Ensure the correction does not push values beyond the valid range
                 estimate = np.clip(estimate, 0, 255)  # Assuming 8-bit image
+            self.corrections[index, completed_iterations] = correction_factor
 
-        # Update the PSF estimate
-        self._update_psf(channel, estimate)
+            completed_iterations += 1
+            # The last iteration is saved together with the PSF update, in _finish_channel
+            if (
+                self.checkpoint_interval
+                and completed_iterations % self.checkpoint_interval == 0
+                and completed_iterations < self.iterations
+            ):
+                self._publish(index, estimate, completed_iterations)
 
         return estimate
 
+    def _finish_channel(self, index, estimate):
+        """
+        Update the PSF estimate from the final estimate of a channel, store both and save a checkpoint.
+
+        :param index: Index of the color channel.
+        :param estimate: The estimate returned by `_iterate_channel`, or None to only save a checkpoint.
+        """
+        if estimate is not None:
+            self._update_psf(self._channels(self.image)[index], estimate)
+            self._publish(index, estimate, self.iterations)
+        else:
+            with self._state_lock:
+                self._save_checkpoint()
+
+    def _publish(self, index, estimate, completed_iterations):
+        """
+        Store the progress of a channel in the state, together with its number of iterations, and save a
+        checkpoint, so that a checkpoint never pairs an estimate with the wrong number of iterations.
+
+        :param index: Index of the color channel.
+        :param estimate: The current estimate of the channel.
+        :param completed_iterations: The number of iterations the estimate went through.
+        """
+        with self._state_lock:
+            self._channels(self.estimate)[index][...] = estimate
+            self.completed_iterations[index] = completed_iterations
+            self._save_checkpoint()
+
+    def _initialize_state(self):
+        """
+        Start a new deconvolution from the initial estimate, or from the image itself.
+        """
+        initial = self.image if self.initial_estimate is None else self.initial_estimate
+        self.estimate = np.array(initial, dtype=np.float64)
+        self.completed_iterations = np.zeros(len(self.original_mean), dtype=np.int64)
+
+    def _state(self):
+        """
+        Gather the deconvolution state without copying it.
+
+        :return: The deconvolution state as a dictionary of numpy arrays.
+        """
+        return {
+            "estimate": self.estimate,
+            "psf": self.psf,
+            "iterations": self.completed_iterations,
+            "original_mean": self.original_mean,
+            "original_std": self.original_std,
+        }
+
+    def _save_checkpoint(self):
+        """
+        Save the current state to the checkpoint path, if one was given.
+        """
+        if self.checkpoint_path is not None:
+            save_state(self.checkpoint_path, self._state())
+
+    def _channels(self, image):
+        """
+        Split an image into its channels, as views.
+
+        :param image: 2D (grayscale) or 3D (color) image as a numpy array.
+        :return: List of 2D channels.
+        """
+        if image.ndim == 3:
+            return [image[:, :, i] for i in range(3)]
+        return [image]
+
     def _update_psf(self, original, estimate):
         """
         Update the PSF based on the latest image estimate and the original image.
@@ -76,54 +392,36 @@ class FastBlindRichardsonLucy:
         :param original: Original image channel.
         :param estimate: Latest deconvolved image estimate.
         """
-        flipped_estimate = np.flipud(
-            np.fliplr(estimate)
-        )  # Precompute the flipped estimate once per iteration
+        # Only the center of the correlation between the error ratio and the estimate is kept. Convolving with a
+        # kernel as large as the image wraps around it exactly once, i.e. it is a circular convolution: it is
+        # computed on the transform size of the image, with the spectrum of the flipped estimate computed once,
+        # instead of on a padded transform three times as large in each direction.
+        shape = estimate.shape
+        flipped_spectrum = self.fft_backend.rfft2(np.flipud(np.fliplr(estimate)))
+        # Indices of the center of the wrap-around convolution, in the circular one
+        rows = (np.arange(self.psf.shape[0]) - self.psf.shape[0] // 2 - 1) % shape[0]
+        columns = (np.arange(self.psf.shape[1]) - self.psf.shape[1] // 2 - 1) % shape[1]
         for _ in range(self.psf_iterations):
             estimated_convolution = self._convolve2d(estimate, self.psf)
             error_ratio = original / (estimated_convolution + 1e-12)
-            full_psf_update = self._convolve2d(error_ratio, flipped_estimate)
+            correlation = self.fft_backend.irfft2(
+                self.fft_backend.rfft2(error_ratio) * flipped_spectrum, shape
+            )
 
-            # Crop to match the PSF size
-            psf_update = self._crop_center(full_psf_update, self.psf.shape)
-            self.psf *= psf_update
+            self.psf *= correlation[np.ix_(rows, columns)]
             self.psf /= np.sum(self.psf)  # Normalize PSF to maintain energy
 
+        # Keep the mirrored PSF in sync with the refined PSF
+        self.psf_mirror = np.flipud(np.fliplr(self.psf))
+
     def _convolve2d(self, image, kernel):
         """
         Perform a 2D convolution of an image with a kernel, simulating the behavior of scipy.signal.convolve2d.
-        Way faster than richardson_lucy._convolve2d because it uses FFT-based convolution.
+        Way faster than richardson_lucy._convolve2d because it uses FFT-based convolution, through the
+        configured FFT backend and on fast transform sizes.
 
         :param image: Input image as a numpy array.
         :param kernel: Convolution kernel as a numpy array.
         :return: Convolved image as a numpy array.
         """
-        # Compute padding widths
-        pad_height = kernel.shape[0] // 2
-        pad_width = kernel.shape[1] // 2
-
-        # Manually wrap the boundary by padding
-        padded_image = np.pad(
-            image, ((pad_height, pad_height), (pad_width, pad_width)), mode="wrap"
-        )
-
-        # Perform FFT-based convolution on the padded image
-        result = fftconvolve(padded_image, kernel, mode="same")
-
-        # Crop the result back to the original image size
-        result_cropped = result[pad_height:-pad_height, pad_width:-pad_width]
-
-        return result_cropped
-
-    def _crop_center(self, img, cropsize):
-        """
-        Crop the center of an image to a specified size.
-
-        :param img: Input image as a numpy array.
-        :param cropsize: Tuple specifying the desired crop size.
-        """
-        y, x = img.shape
-        cropx, cropy = cropsize
-        startx = x // 2 - (cropx // 2)
-        starty = y // 2 - (cropy // 2)
-        return img[starty : starty + cropy, startx : startx + cropx]
+        return convolve_wrap(image, kernel, self.fft_backend)
@@ -1,9 +1,26 @@
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from scipy.signal import convolve2d
+from image_processing.deconvolution_state import save_state
+from image_processing.fft_backend import get_fft_backend, convolve_wrap
+from image_processing.kernels import Kernel, scale_kernel
+from image_processing.roi import roi_halo, deconvolve_rois
 
 
 class FastRichardsonLucy:
-    def __init__(self, image, psf, iterations=10):
+    def __init__(
+        self,
+        image,
+        psf,
+        iterations=10,
+        initial_estimate=None,
+        checkpoint_path=None,
+        checkpoint_interval=None,
+        threads=1,
+        fft_backend=None,
+        correction_factors=None,
+    ):
         """
         Initializes the Richardson-Lucy deconvolution process with the given image, point spread function (PSF),
         and number of iterations.
@@ -14,73 +31,324 @@ class FastRichardsonLucy:
         :type psf: numpy.ndarray
         :param iterations: The number of iterations to run the deconvolution algorithm, defaults to 10.
         :type iterations: int
+        :param initial_estimate: Optional starting point for the iterations, with the same shape as the image.
+            Defaults to the image itself.
+        :type initial_estimate: numpy.ndarray
+        :param checkpoint_path: Optional .npz path where the state is saved while running, so that an
+            interrupted run can be resumed with `import_state`.
+        :type checkpoint_path: str
+        :param checkpoint_interval: Number of iterations between two checkpoints. Defaults to None, which only
+            saves once each channel is done.
+        :type checkpoint_interval: int
+        :param threads: Number of threads used inside `apply`, defaults to 1. Channels run concurrently, and the
+            remaining threads split each FFT, so even a grayscale image uses them all. `scipy.signal.convolve2d`
+            holds the GIL, so with more than one thread the convolutions go through the FFT backend, which
+            matches the single-threaded result up to floating-point rounding.
+        :type threads: int
+        :param fft_backend: Optional FFT backend of the convolutions, from `image_processing.fft_backend`.
+            Defaults to None, which convolves with `scipy.signal.convolve2d` on a single thread, and through
+            `get_fft_backend()` with the threads left per channel otherwise.
+        :param correction_factors: Optional lighting and contrast correction factors, of shape (channels,
+            iterations), applied instead of the ones measured on the image, e.g. the ones of the whole image when
+            deconvolving a region of it. Defaults to None.
+        :type correction_factors: numpy.ndarray
         """
         self.image = image
         self.psf = psf
         self.iterations = iterations
+        self.initial_estimate = initial_estimate
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.threads = threads
+        self.fft_backend = fft_backend
+        self.correction_factors = correction_factors
         self.psf_mirror = np.flipud(np.fliplr(self.psf))  # Precompute the mirrored PSF
 
+        # Deconvolution state: current estimate (float64), completed iterations and
+        # lighting statistics of the original image, per channel
+        self.estimate = None
+        self.completed_iterations = None
+        channels = self._channels(image)
+        self.original_mean = np.array([np.mean(channel) for channel in channels])
+        self.original_std = np.array([np.std(channel) for channel in channels])
+        # Lighting and contrast correction factor applied at each iteration, per channel (NaN when skipped)
+        self.corrections = np.full((len(channels), iterations), np.nan)
+        # Guards the state while concurrent channels update and save it
+        self._state_lock = threading.Lock()
+
     def apply(self):
         """
         Deblurs the image using the Richardson-Lucy deconvolution algorithm. This method supports both grayscale
         and color images by processing each channel separately if necessary.
 
+        If a state was imported, the deconvolution resumes from it and only runs the missing iterations.
+
         :return: The deblurred image, with the same dimensions as the input image.
         :rtype: numpy.ndarray
         """
-        # Determine if the image is grayscale or color
-        if self.image.ndim == 3:
-            # Process each channel separately
-            channels = []
-            for i in range(3):  # Assuming the image is in RGB format
-                channel = self._apply_to_channel(self.image[:, :, i])
-                channels.append(channel)
-            # Stack the processed channels back together
-            deblurred_image = np.stack(channels, axis=-1)
+        if self.estimate is None:
+            self._initialize_state()
+
+        # Process each channel separately (a grayscale image has a single one)
+        indices = range(len(self.completed_iterations))
+        channel_threads = max(1, min(self.threads, len(indices)))
+        convolve = self._convolve2d
+        if self.fft_backend is not None or self.threads > 1:
+            # The FFT releases the GIL, so concurrent channels and the threads of each transform overlap
+            fft_backend = self.fft_backend
+            if fft_backend is None:
+                fft_backend = get_fft_backend(workers=max(1, self.threads // channel_threads))
+
+            def convolve(image, kernel):
+                return convolve_wrap(image, np.flipud(np.fliplr(kernel)), fft_backend)
+
+        if channel_threads > 1:
+            with ThreadPoolExecutor(max_workers=channel_threads) as executor:
+                # Consuming the results re-raises the first failure
+                list(
+                    executor.map(
+                        lambda index: self._apply_to_channel(index, convolve), indices
+                    )
+                )
         else:
-            # Process a grayscale image
-            deblurred_image = self._apply_to_channel(self.image)
+            for index in indices:
+                self._apply_to_channel(index, convolve)
+
+        return self.estimate
+
+    def apply_rois(self, boxes, correction_factors=None):
+        """
+        Deblurs only some regions of interest of the image, e.g. a license plate or a face. Each region is
+        deconvolved with a halo sized from the PSF radius and the number of iterations, so the latency scales
+        with the area of the regions instead of the whole image.
+
+        Pixels inside a region only depend on pixels within the halo, except through the lighting and contrast
+        correction, which scales the estimate by a factor measured on the whole image at each iteration. The
+        regions are therefore deconvolved with the factors of the whole image: either `correction_factors`, e.g.
+        the `corrections` of a full-frame run, which gives the same result up to floating-point rounding, or
+        factors estimated by a full-frame run at half resolution, which matches a full-frame run within about
+        0.5 gray levels on average and 3 at most inside the regions. Kernels smaller than 5 pixels would shrink to
+        about a single pixel at half resolution, so the whole image is deconvolved instead.
+
+        :param boxes: The regions of interest, as (left, upper, right, lower) tuples.
+        :type boxes: list
+        :param correction_factors: Optional lighting and contrast correction factors of the whole image, of
+            shape (channels, iterations). Defaults to None, which estimates them.
+        :type correction_factors: numpy.ndarray
+        :return: A copy of the image where the regions of interest are deblurred.
+        :rtype: numpy.ndarray
+        """
+        halo = roi_halo(self.psf.shape, self.iterations)
+        if correction_factors is None and min(self.psf.shape) < 5:
+            # A halo as large as the image makes deconvolve_rois deconvolve the whole image, once
+            halo = max(self.image.shape[:2])
+
+        factors = [correction_factors]
+
+        def deconvolve(crop):
+            if crop is self.image:
+                # The halo covers the whole image, which measures its own factors
+                return self._region_deconvolver(crop, None).apply()
+            if factors[0] is None:
+                factors[0] = self._half_resolution_corrections()
+            return self._region_deconvolver(crop, factors[0]).apply()
 
-        return deblurred_image
+        return deconvolve_rois(self.image, boxes, halo, deconvolve)
+
+    def export_state(self):
+        """
+        Exports the full deconvolution state, so that it can be saved with
+        `image_processing.deconvolution_state.save_state` and resumed later.
+
+        :return: The current estimate, PSF, completed iterations per channel and lighting statistics.
+        :rtype: dict
+        """
+        if self.estimate is None:
+            self._initialize_state()
+        return {key: np.copy(value) for key, value in self._state().items()}
+
+    def import_state(self, state):
+        """
+        Imports a deconvolution state exported by `export_state`. The next call to `apply` resumes from it.
+
+        :param state: The deconvolution state.
+        :type state: dict
+        :raises ValueError: If the state was computed for another image or PSF, or with more iterations than requested.
+        """
+        if state["estimate"].shape != self.image.shape:
+            raise ValueError("State does not match the image shape.")
+        if not np.allclose(state["original_mean"], self.original_mean) or not np.allclose(
+            state["original_std"], self.original_std
+        ):
+            raise ValueError("State was computed for another image.")
+        if not np.array_equal(state["psf"], self.psf):
+            raise ValueError("State was computed with another PSF.")
+        if np.max(state["iterations"]) > self.iterations:
+            raise ValueError("State has more iterations than requested.")
+
+        self.estimate = np.array(state["estimate"], dtype=np.float64)
+        self.completed_iterations = np.array(state["iterations"], dtype=np.int64)
+
+    def _region_deconvolver(self, image, correction_factors):
+        """
+        Creates the deconvolver of a region of interest, with the settings of this one.
+
+        :param image: The region and its halo.
+        :type image: numpy.ndarray
+        :param correction_factors: The lighting and contrast correction factors of the whole image, or None.
+        :type correction_factors: numpy.ndarray
+        :return: The deconvolver.
+        :rtype: FastRichardsonLucy
+        """
+        return FastRichardsonLucy(
+            image,
+            self.psf,
+            self.iterations,
+            threads=self.threads,
+            fft_backend=self.fft_backend,
+            correction_factors=correction_factors,
+        )
 
-    def _apply_to_channel(self, channel):
+    def _half_resolution_corrections(self):
+        """
+        Estimates the lighting and contrast correction factors of a full-frame run with a full-frame run at half
+        resolution, on the image averaged over blocks of 2x2 pixels and the PSF scaled accordingly.
+
+        :return: The correction factors, of shape (channels, iterations).
+        :rtype: numpy.ndarray
+        """
+        height, width = self.image.shape[0] // 2, self.image.shape[1] // 2
+        image = np.asarray(self.image[: 2 * height, : 2 * width], dtype=np.float64)
+        image = image.reshape((height, 2, width, 2) + image.shape[2:]).mean(axis=(1, 3))
+        psf = scale_kernel(Kernel("psf", self.psf, max(self.psf.shape)), 0.5).kernel
+
+        deconvolver = FastRichardsonLucy(
+            image,
+            psf,
+            self.iterations,
+            threads=self.threads,
+            fft_backend=self.fft_backend if self.fft_backend is not None else get_fft_backend(),
+        )
+        deconvolver.apply()
+        return deconvolver.corrections
+
+    def _apply_to_channel(self, index, convolve=None):
         """
         Applies the Richardson-Lucy deconvolution algorithm to a single channel of the image.
 
         This private method is utilized by the `apply` method to process each color channel separately for color images,
-        or directly on the image if it is grayscale.
+        or directly on the image if it is grayscale. It runs the iterations this channel is still missing, stores
+        the result in the current estimate and saves a checkpoint.
 
-        :param channel: A single channel of the blurry and noisy image, as a 2D numpy array.
-        :type channel: numpy.ndarray
-        :return: The deblurred channel.
-        :rtype: numpy.ndarray
+        :param index: The index of the channel to process.
+        :type index: int
+        :param convolve: The convolution function, defaults to None, which uses `_convolve2d`.
+        :type convolve: callable
         """
+        channel = self._channels(self.image)[index]
+        estimate = np.copy(self._channels(self.estimate)[index])
+        completed_iterations = self.completed_iterations[index]
 
-        # Calculate the mean and standard deviation of the original channel for
-        # lighting and contrast correction
-        original_mean = np.mean(channel)
-        original_std = np.std(channel)
+        # Lighting and contrast correction targets, from the original channel
+        original_mean = self.original_mean[index]
+        original_std = self.original_std[index]
 
-        estimate = np.copy(channel)
+        if convolve is None:
+            convolve = self._convolve2d
 
-        for _ in range(self.iterations):
-            convolved_estimate = self._convolve2d(estimate, self.psf)
+        while completed_iterations < self.iterations:
+            convolved_estimate = convolve(estimate, self.psf)
             relative_blur = channel / (convolved_estimate + 1e-12)
-            error_estimate = self._convolve2d(relative_blur, self.psf_mirror)
+            error_estimate = convolve(relative_blur, self.psf_mirror)
             estimate = estimate * error_estimate
 
             # Incremental lighting and contrast correction
-            estimate_mean = np.mean(estimate)
-            estimate_std = np.std(estimate)
+            if self.correction_factors is not None:
+                correction_factor = self.correction_factors[index][completed_iterations]
+            else:
+                estimate_mean = np.mean(estimate)
+                estimate_std = np.std(estimate)
+                correction_factor = np.nan
+                if estimate_mean > 0 and estimate_std > 0:
+                    mean_correction_factor = original_mean / estimate_mean
+                    std_correction_factor = original_std / estimate_std
+                    correction_factor = mean_correction_factor * std_correction_factor
 
-            if estimate_mean > 0 and estimate_std > 0:
-                mean_correction_factor = original_mean / estimate_mean
-                std_correction_factor = original_std / estimate_std
-                estimate = (estimate * mean_correction_factor) * std_correction_factor
+            if not np.isnan(correction_factor):
+                estimate = estimate * correction_factor
                 # Ensure the correction does not push values beyond the valid range
                 estimate = np.clip(estimate, 0, 255)  # Assuming 8-bit image
+            self.corrections[index, completed_iterations] = correction_factor
 
-        return estimate
+            completed_iterations += 1
+            if (
+                self.checkpoint_interval
+                and completed_iterations % self.checkpoint_interval == 0
+                and completed_iterations < self.iterations
+            ):
+                self._publish(index, estimate, completed_iterations)
+
+        self._publish(index, estimate, completed_iterations)
+
+    def _publish(self, index, estimate, completed_iterations):
+        """
+        Stores the progress of a channel in the state, together with its number of iterations, and saves a
+        checkpoint, so that a checkpoint never pairs an estimate with the wrong number of iterations.
+
+        :param index: The index of the channel.
+        :type index: int
+        :param estimate: The current estimate of the channel.
+        :type estimate: numpy.ndarray
+        :param completed_iterations: The number of iterations the estimate went through.
+        :type completed_iterations: int
+        """
+        with self._state_lock:
+            self._channels(self.estimate)[index][...] = estimate
+            self.completed_iterations[index] = completed_iterations
+            self._save_checkpoint()
+
+    def _initialize_state(self):
+        """
+        Starts a new deconvolution from the initial estimate, or from the image itself.
+        """
+        initial = self.image if self.initial_estimate is None else self.initial_estimate
+        self.estimate = np.array(initial, dtype=np.float64)
+        self.completed_iterations = np.zeros(len(self.original_mean), dtype=np.int64)
+
+    def _state(self):
+        """
+        Gathers the deconvolution state without copying it.
+
+        :return: The deconvolution state.
+        :rtype: dict
+        """
+        return {
+            "estimate": self.estimate,
+            "psf": np.asarray(self.psf, dtype=np.float64),
+            "iterations": self.completed_iterations,
+            "original_mean": self.original_mean,
+            "original_std": self.original_std,
+        }
+
+    def _save_checkpoint(self):
+        """
+        Saves the current state to the checkpoint path, if one was given.
+        """
+        if self.checkpoint_path is not None:
+            save_state(self.checkpoint_path, self._state())
+
+    def _channels(self, image):
+        """
+        Splits an image into its channels, as views.
+
+        :param image: A 2D (grayscale) or 3D (color) numpy array.
+        :type image: numpy.ndarray
+        :return: The list of 2D channels.
+        :rtype: list
+        """
+        if image.ndim == 3:
+            return [image[:, :, i] for i in range(3)]  # Assuming the image is in RGB format
+        return [image]
 
     def _convolve2d(self, image, kernel):
         """
@@ -0,0 +1,247 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import scipy.fft
+
+try:
+    import pyfftw
+except ImportError:  # pyfftw is optional
+    pyfftw = None
+
+# Backends are shared between deconvolvers, so that pyfftw plans are reused across images
+_backends = {}
+
+
+class NumpyFFTBackend:
+    """
+    Real 2D FFTs computed with numpy.fft, single-threaded.
+    """
+
+    name = "numpy"
+
+    def rfft2(self, array, shape=None):
+        """
+        Computes the 2D FFT of a real array.
+
+        :param array: The real 2D array to transform.
+        :type array: numpy.ndarray
+        :param shape: Optional transform shape; the array is zero-padded up to it.
+        :type shape: tuple
+        :return: The half spectrum, of shape (shape[0], shape[1] // 2 + 1).
+        :rtype: numpy.ndarray
+        """
+        return np.fft.rfft2(array, s=shape)
+
+    def irfft2(self, spectrum, shape):
+        """
+        Computes the inverse of `rfft2`.
+
+        :param spectrum: The half spectrum to transform back.
+        :type spectrum: numpy.ndarray
+        :param shape: The shape of the real output.
+        :type shape: tuple
+        :return: The real 2D array.
+        :rtype: numpy.ndarray
+        """
+        return np.fft.irfft2(spectrum, s=shape)
+
+
+class ScipyFFTBackend:
+    """
+    Real 2D FFTs computed with scipy.fft, split across `workers` threads.
+    """
+
+    name = "scipy"
+
+    def __init__(self, workers=None):
+        """
+        :param workers: Number of threads per transform. Defaults to None, which uses every core.
+        :type workers: int
+        """
+        self.workers = workers if workers is not None else os.cpu_count()
+
+    def rfft2(self, array, shape=None):
+        return scipy.fft.rfft2(array, s=shape, workers=self.workers)
+
+    def irfft2(self, spectrum, shape):
+        return scipy.fft.irfft2(spectrum, s=shape, workers=self.workers)
+
+
+class PyFFTWBackend:
+    """
+    Real 2D FFTs computed with FFTW through pyfftw, split across `threads` threads. A plan is built once per
+    input shape and transform shape and then reused, instead of being planned again on every call.
+
+    Plans own their buffers, so each calling thread builds and keeps its own plans, and concurrent threads
+    transform in parallel. Each thread only keeps its `max_plans` most recently used plans, so a long-lived
+    process seeing many image shapes, e.g. the deblur service, does not accumulate them. FFTW keeps what it
+    measured (its wisdom) for the whole process, so planning a shape again is much faster than the first time.
+    """
+
+    name = "pyfftw"
+
+    def __init__(self, threads=None, planner_effort="FFTW_MEASURE", max_plans=32):
+        """
+        :param threads: Number of threads per transform. Defaults to None, which uses every core.
+        :type threads: int
+        :param planner_effort: The FFTW planner effort, defaults to "FFTW_MEASURE".
+        :type planner_effort: str
+        :param max_plans: Maximum number of plans kept per calling thread, defaults to 32. A convolution uses
+            three plans per image shape.
+        :type max_plans: int
+        :raises ImportError: If pyfftw is not installed.
+        """
+        if pyfftw is None:
+            raise ImportError("The pyfftw FFT backend requires pyfftw to be installed.")
+        self.threads = threads if threads is not None else os.cpu_count()
+        self.planner_effort = planner_effort
+        self.max_plans = max_plans
+        self._local = threading.local()
+
+    def rfft2(self, array, shape=None):
+        shape = tuple(shape) if shape is not None else array.shape
+        plan = self._plan("rfft2", array, shape)
+        # The plan returns its internal output buffer, which the next call overwrites
+        return np.copy(plan(array))
+
+    def irfft2(self, spectrum, shape):
+        plan = self._plan("irfft2", spectrum, tuple(shape))
+        return np.copy(plan(spectrum))
+
+    def _plan(self, transform, array, shape):
+        """
+        Returns the cached plan of the calling thread for a transform, building it on first use and evicting the
+        least recently used plan beyond `max_plans`.
+
+        :param transform: Either "rfft2" or "irfft2".
+        :type transform: str
+        :param array: The input array of the transform.
+        :type array: numpy.ndarray
+        :param shape: The transform shape.
+        :type shape: tuple
+        :return: The callable pyfftw plan.
+        :rtype: pyfftw.FFTW
+        """
+        plans = getattr(self._local, "plans", None)
+        if plans is None:
+            plans = self._local.plans = OrderedDict()
+
+        key = (transform, array.shape, array.dtype, shape)
+        if key in plans:
+            plans.move_to_end(key)
+            return plans[key]
+
+        builder = getattr(pyfftw.builders, transform)
+        plans[key] = builder(
+            np.empty_like(array),
+            s=shape,
+            threads=self.threads,
+            planner_effort=self.planner_effort,
+        )
+        if len(plans) > self.max_plans:
+            plans.popitem(last=False)
+        return plans[key]
+
+
+def get_fft_backend(name=None, workers=None):
+    """
+    Returns the shared FFT backend with the given name and thread count, creating it on first use.
+
+    :param name: Either "numpy", "scipy" or "pyfftw". Defaults to None, which picks pyfftw when it is installed
+        and scipy otherwise.
+    :type name: str
+    :param workers: Number of threads per transform, ignored by the numpy backend. Defaults to every core.
+    :type workers: int
+    :return: The FFT backend.
+    :raises ValueError: If the backend name is unknown.
+    """
+    if name is None:
+        name = "pyfftw" if pyfftw is not None else "scipy"
+
+    key = (name, workers)
+    if key not in _backends:
+        if name == "numpy":
+            _backends[key] = NumpyFFTBackend()
+        elif name == "scipy":
+            _backends[key] = ScipyFFTBackend(workers)
+        elif name == "pyfftw":
+            _backends[key] = PyFFTWBackend(workers)
+        else:
+            raise ValueError(f"Unknown FFT backend: {name}.")
+    return _backends[key]
+
+
+def fast_shape(shape):
+    """
+    Rounds a transform shape up to sizes that the FFT computes efficiently (products of small primes).
+
+    :param shape: The minimal transform shape.
+    :type shape: tuple
+    :return: The padded transform shape.
+    :rtype: tuple
+    """
+    return tuple(scipy.fft.next_fast_len(int(n), real=True) for n in shape)
+
+
+def psf_to_otf(psf, shape, backend):
+    """
+    Computes the optical transfer function (OTF) of a PSF for an image of the given shape, i.e. the spectrum of
+    the wrap-around convolution with the PSF.
+
+    :param psf: The Point Spread Function, as a 2D numpy array.
+    :type psf: numpy.ndarray
+    :param shape: The (height, width) of the image.
+    :type shape: tuple
+    :param backend: The FFT backend.
+    :return: The OTF, as a half spectrum.
+    :rtype: numpy.ndarray
+    """
+    padded_psf = np.zeros(shape)
+    padded_psf[: psf.shape[0], : psf.shape[1]] = psf
+
+    # Move the center of the PSF to the origin
+    padded_psf = np.roll(
+        padded_psf, (-(psf.shape[0] // 2), -(psf.shape[1] // 2)), axis=(0, 1)
+    )
+    return backend.rfft2(padded_psf)
+
+
+def convolve_wrap(image, kernel, backend):
+    """
+    Convolves an image with a kernel through the FFT, wrapping around the image borders.
+
+    The image is padded by wrapping, linearly convolved on a fast transform size, and cropped back, which gives
+    the same result as `scipy.signal.fftconvolve(..., mode="same")` on the padded image.
+
+    :param image: The 2D image as a numpy array.
+    :type image: numpy.ndarray
+    :param kernel: The 2D convolution kernel as a numpy array.
+    :type kernel: numpy.ndarray
+    :param backend: The FFT backend.
+    :return: The convolved image, with the same shape as the input image.
+    :rtype: numpy.ndarray
+    """
+    pad_height = kernel.shape[0] // 2
+    pad_width = kernel.shape[1] // 2
+    padded_image = np.pad(
+        image, ((pad_height, pad_height), (pad_width, pad_width)), mode="wrap"
+    )
+
+    full_shape = (
+        padded_image.shape[0] + kernel.shape[0] - 1,
+        padded_image.shape[1] + kernel.shape[1] - 1,
+    )
+    transform_shape = fast_shape(full_shape)
+    spectrum = backend.rfft2(padded_image, transform_shape) * backend.rfft2(
+        kernel, transform_shape
+    )
+    full_result = backend.irfft2(spectrum, transform_shape)
+
+    # The "same" output starts at (kernel - 1) // 2, and the padding is kernel // 2 more
+    start_row = kernel.shape[0] - 1
+    start_column = kernel.shape[1] - 1
+    return full_result[
+        start_row : start_row + image.shape[0],
+        start_column : start_column + image.shape[1],
+    ]
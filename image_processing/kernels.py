@@ -1,8 +1,11 @@
 import numpy as np
+from functools import partial
+from scipy.special import j1
+from image_processing.fft_backend import get_fft_backend, psf_to_otf
 
 
 class Kernel:
-    def __init__(self, name, kernel, kernel_size, sigma=None):
+    def __init__(self, name, kernel, kernel_size, sigma=None, otf_function=None):
         """
         Create a new Kernel object with a given name and kernel matrix.
 
@@ -12,11 +15,34 @@ class Kernel:
         :type kernel: ndarray
         :param kernel_size: The size of the kernel matrix.
         :type kernel_size: int
+        :param otf_function: Optional function computing the OTF analytically for a given image shape.
+        :type otf_function: callable
         """
         self.name = name
         self.kernel = kernel
         self.size = kernel_size
         self.sigma = sigma
+        self.otf_function = otf_function
+
+    def otf(self, shape, fft_backend=None):
+        """
+        Compute the optical transfer function (OTF) of the kernel for an image of the given shape, as a half
+        spectrum (the layout of `rfft2`) of the wrap-around convolution.
+
+        Kernels with an analytic OTF evaluate it directly at the image frequencies, so that large kernels cost
+        nothing more than small ones. Other kernels pad and transform their matrix.
+
+        :param shape: The (height, width) of the image.
+        :type shape: tuple
+        :param fft_backend: The FFT backend, used when the OTF is not analytic. Defaults to `get_fft_backend()`.
+        :return: The OTF, of shape (height, width // 2 + 1).
+        :rtype: ndarray
+        """
+        if self.otf_function is not None:
+            return self.otf_function(shape)
+        if fft_backend is None:
+            fft_backend = get_fft_backend()
+        return psf_to_otf(self.kernel, shape, fft_backend)
 
     def __str__(self):
         if self.sigma is not None:
@@ -55,7 +81,7 @@ def kernel_gaussian(size=3, sigma=1.0):
     :type size: int
     :param sigma: The standard deviation of the Gaussian distribution.
     :type sigma: float
-    :return: An instance of the Kernel class representing the Gaussian kernel.
+    :return: An instance of the Kernel class representing the Gaussian kernel, with an analytic OTF.
     :rtype: Kernel
     :raises ValueError: If the kernel size is not an odd number.
     """
@@ -66,7 +92,211 @@ def kernel_gaussian(size=3, sigma=1.0):
     gauss = np.exp(-0.5 * np.square(ax) / np.square(sigma))
     kernel_matrix = np.outer(gauss, gauss)
     kernel_matrix /= np.sum(kernel_matrix)
-    return Kernel(f"gaussian", kernel_matrix, size, sigma)
+
+    otf_function = partial(_gaussian_otf, taps=gauss / np.sum(gauss))
+    return Kernel(f"gaussian", kernel_matrix, size, sigma, otf_function)
+
+
+def kernel_motion(length=9, angle=0.0):
+    """
+    Creates a linear motion kernel: a line segment of the given length, as left by a camera or object moving
+    in a straight line during the exposure.
+
+    :param length: The length of the motion, in pixels.
+    :type length: float
+    :param angle: The direction of the motion, in degrees counterclockwise from the horizontal.
+    :type angle: float
+    :return: An instance of the Kernel class representing the motion kernel, with an analytic OTF.
+    :rtype: Kernel
+    :raises ValueError: If the length is smaller than one pixel.
+    """
+    if length < 1:
+        raise ValueError("Motion length must be at least one pixel.")
+
+    theta = np.deg2rad(angle)
+    # Direction of the motion in (row, column) coordinates, rows pointing down
+    direction_y, direction_x = -np.sin(theta), np.cos(theta)
+
+    half_size = int(np.ceil(length / 2))
+    size = 2 * half_size + 1
+    kernel_matrix = np.zeros((size, size))
+
+    # Spread densely sampled points of the segment over their neighboring pixels (bilinear weights)
+    positions = np.linspace(-length / 2, length / 2, int(np.ceil(length)) * 16 + 1)
+    rows = half_size + positions * direction_y
+    columns = half_size + positions * direction_x
+    row_floor = np.floor(rows).astype(int)
+    column_floor = np.floor(columns).astype(int)
+    row_fraction = rows - row_floor
+    column_fraction = columns - column_floor
+    for row_offset, row_weight in ((0, 1 - row_fraction), (1, row_fraction)):
+        for column_offset, column_weight in (
+            (0, 1 - column_fraction),
+            (1, column_fraction),
+        ):
+            np.add.at(
+                kernel_matrix,
+                (
+                    np.clip(row_floor + row_offset, 0, size - 1),
+                    np.clip(column_floor + column_offset, 0, size - 1),
+                ),
+                row_weight * column_weight,
+            )
+    kernel_matrix /= np.sum(kernel_matrix)
+
+    continuous_otf = partial(
+        _motion_continuous_otf,
+        length=length,
+        direction_y=direction_y,
+        direction_x=direction_x,
+    )
+    otf_function = partial(_sampled_otf, continuous_otf)
+    return Kernel(
+        f"motion_length{length}_angle{angle}", kernel_matrix, size, None, otf_function
+    )
+
+
+def kernel_disk(radius=4.0):
+    """
+    Creates a disk kernel: a uniform disk of the given radius, the shape of an out-of-focus (defocus) blur.
+
+    :param radius: The radius of the disk, in pixels.
+    :type radius: float
+    :return: An instance of the Kernel class representing the disk kernel, with an analytic OTF.
+    :rtype: Kernel
+    :raises ValueError: If the radius is not positive.
+    """
+    if radius <= 0:
+        raise ValueError("Disk radius must be positive.")
+
+    half_size = int(np.ceil(radius))
+    size = 2 * half_size + 1
+
+    # Fraction of each pixel covered by the disk, from 8x8 samples per pixel
+    samples = (np.arange(size * 8) + 0.5) / 8 - half_size - 0.5
+    inside = samples[:, np.newaxis] ** 2 + samples[np.newaxis, :] ** 2 <= radius**2
+    kernel_matrix = inside.reshape(size, 8, size, 8).mean(axis=(1, 3))
+    kernel_matrix /= np.sum(kernel_matrix)
+
+    otf_function = partial(_sampled_otf, partial(_disk_continuous_otf, radius=radius))
+    return Kernel(f"disk_radius{radius}", kernel_matrix, size, None, otf_function)
+
+
+def scale_kernel(kernel_obj, scale):
+    """
+    Resamples a kernel for an image resized by the given factor, e.g. to deblur a low-resolution preview with the
+    blur of the full-resolution image. Each pixel of the kernel is treated as a small square, and every pixel of
+    the scaled kernel receives the part of it that it covers, so small blurs shrink to a single pixel instead of
+    vanishing.
+
+    :param kernel_obj: The kernel at full resolution.
+    :type kernel_obj: Kernel
+    :param scale: The resize factor of the image, e.g. 0.25 for a preview four times smaller.
+    :type scale: float
+    :return: The scaled kernel, with an odd size, normalized to sum to one.
+    :rtype: Kernel
+    :raises ValueError: If the scale is not positive.
+    """
+    if scale <= 0:
+        raise ValueError("Scale must be positive.")
+
+    def overlap(input_size, output_size):
+        # Length of the intersection between input pixel i and output pixel j, both centered on the origin,
+        # in output pixel units
+        input_edges = (np.arange(input_size + 1) - input_size / 2) * scale
+        output_edges = np.arange(output_size + 1) - output_size / 2
+        lower = np.maximum(output_edges[:-1, np.newaxis], input_edges[np.newaxis, :-1])
+        upper = np.minimum(output_edges[1:, np.newaxis], input_edges[np.newaxis, 1:])
+        return np.clip(upper - lower, 0, None)
+
+    height, width = kernel_obj.kernel.shape
+    size = 2 * max(0, int(np.ceil((max(height, width) * scale - 1) / 2))) + 1
+    kernel_matrix = overlap(height, size) @ kernel_obj.kernel @ overlap(width, size).T
+    kernel_matrix /= np.sum(kernel_matrix)
+
+    sigma = kernel_obj.sigma * scale if kernel_obj.sigma is not None else None
+    return Kernel(kernel_obj.name, kernel_matrix, size, sigma)
+
+
+# The OTF functions are module-level (bound with functools.partial) so that kernels can be pickled
+# and sent to worker processes.
+
+
+def _gaussian_otf(shape, taps):
+    """
+    Computes the OTF of a sampled and truncated Gaussian. The kernel is the outer product of two symmetric 1D
+    kernels, so its OTF is the outer product of their DFTs, each a short sum of cosines over the taps: the cost
+    depends on the kernel size, not on the image size.
+
+    :param shape: The (height, width) of the image.
+    :type shape: tuple
+    :param taps: The normalized 1D kernel, of odd length.
+    :type taps: ndarray
+    :return: The OTF, of shape (height, width // 2 + 1).
+    :rtype: ndarray
+    """
+    half_size = len(taps) // 2
+    offsets = np.arange(1, half_size + 1)
+
+    def axis_otf(frequencies):
+        # The taps are symmetric around the center, which `psf_to_otf` moves to the origin
+        cosines = np.cos(2 * np.pi * frequencies[:, np.newaxis] * offsets)
+        return taps[half_size] + 2 * cosines @ taps[half_size + 1 :]
+
+    otf_y = axis_otf(np.fft.fftfreq(shape[0]))
+    otf_x = axis_otf(np.fft.rfftfreq(shape[1]))
+    return np.outer(otf_y, otf_x).astype(np.complex128)
+
+
+def _motion_continuous_otf(frequencies_y, frequencies_x, length, direction_y, direction_x):
+    """
+    Continuous Fourier transform of a motion segment spread over pixels with bilinear weights (a triangle
+    along each axis).
+    """
+    return (
+        np.sinc(length * (frequencies_x * direction_x + frequencies_y * direction_y))
+        * np.sinc(frequencies_x) ** 2
+        * np.sinc(frequencies_y) ** 2
+    )
+
+
+def _disk_continuous_otf(frequencies_y, frequencies_x, radius):
+    """
+    Continuous Fourier transform of a disk integrated over each pixel (a box along each axis).
+    """
+    x = 2 * np.pi * radius * np.sqrt(frequencies_x**2 + frequencies_y**2)
+    # 2 * J1(x) / x, which tends to 1 at the origin
+    x_safe = np.where(x == 0, 1.0, x)
+    disk_otf = np.where(x == 0, 1.0, 2 * j1(x_safe) / x_safe)
+    return disk_otf * np.sinc(frequencies_x) * np.sinc(frequencies_y)
+
+
+def _sampled_otf(continuous_otf, shape, aliases=2):
+    """
+    Evaluates the OTF of a sampled kernel from the Fourier transform of its continuous counterpart, at the
+    frequencies of the half spectrum of an image of the given shape.
+
+    Sampling the kernel on the pixel grid folds the higher frequencies of its continuous transform back into
+    the spectrum, so the neighboring spectral copies are summed as well.
+
+    :param continuous_otf: The continuous Fourier transform, a function of the vertical and horizontal
+        frequencies in cycles per pixel.
+    :type continuous_otf: callable
+    :param shape: The (height, width) of the image.
+    :type shape: tuple
+    :param aliases: Number of spectral copies summed on each side, along each axis.
+    :type aliases: int
+    :return: The OTF, of shape (height, width // 2 + 1).
+    :rtype: ndarray
+    """
+    frequencies_y = np.fft.fftfreq(shape[0])[:, np.newaxis]
+    frequencies_x = np.fft.rfftfreq(shape[1])[np.newaxis, :]
+
+    otf = np.zeros((shape[0], shape[1] // 2 + 1))
+    for alias_y in range(-aliases, aliases + 1):
+        for alias_x in range(-aliases, aliases + 1):
+            otf += continuous_otf(frequencies_y + alias_y, frequencies_x + alias_x)
+    return otf.astype(np.complex128)
 
 
 def apply_kernel(image_array, kernel, border_handling="fill", fill_value=0):
@@ -0,0 +1,396 @@
+import os
+import sys
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+import numpy as np
+from scipy.optimize import nnls
+from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.fast_blind_richardson_lucy import FastBlindRichardsonLucy
+from image_processing.kernels import kernel_average
+
+try:
+    import resource
+except ImportError:  # resource is only available on Unix
+    resource = None
+
+# Peak footprint of a job of the drivers, in bytes, as a linear combination of the features of
+# `MemoryModel.features`: (constant, input image, float64 image, float64 padded channel, checkpoint buffer). Fitted
+# with `MemoryModel.calibrate` on the `process_image` jobs of `fast_core.py` and `fast_blind_core.py`, from 256x256
+# to 1440x1080 color images, 3x3 and 21x21 kernels and uint8 and float32 images, on numpy 2.4 / scipy 1.17.
+DEFAULT_COEFFICIENTS = {
+    "richardson_lucy": np.array([4.85e6, 1.05, 2.303, 0.688, 3.669]),
+    "blind_richardson_lucy": np.array([4.9e6, 0.0, 3.001, 3.416, 1.84]),
+}
+
+
+class MemoryModel:
+    def __init__(self, coefficients=None):
+        """
+        Estimates the peak memory footprint of a job from the shape and dtype of its image, the algorithm and the
+        kernel size, without running it.
+
+        A Richardson-Lucy job holds the float64 estimate, a few float64 temporaries per channel (convolutions,
+        ratios, corrections) and those of the driver around the deconvolution (PSNR, normalization before saving
+        the PNG images), plus the buffers the checkpoint is compressed through. A float32 image costs about
+        10 MiB more than a uint8 one at 1280x908, through the driver's copies at the input dtype. The kernel size
+        barely matters, since `scipy.signal.convolve2d` does not pad the image. Blind Richardson-Lucy also holds a
+        float64 copy of the image and the spectra of its PSF update, and pads each channel by the kernel radius for
+        its FFT convolutions; its peaks do not depend on the dtype, whose feature is fitted to zero, since the image
+        is converted to float64 first.
+
+        The coefficients are fitted on measured jobs (see `calibrate`), and `observe` raises the estimates of an
+        algorithm whenever a job is measured above its estimate.
+
+        :param coefficients: Optional coefficients per algorithm, defaults to `DEFAULT_COEFFICIENTS`.
+        :type coefficients: dict
+        """
+        source = coefficients if coefficients is not None else DEFAULT_COEFFICIENTS
+        self.coefficients = {
+            algorithm: np.array(values, dtype=np.float64)
+            for algorithm, values in source.items()
+        }
+        # Safety margin per algorithm, in bytes: the largest amount a measured peak exceeded the model by
+        self.margins = {algorithm: 0 for algorithm in self.coefficients}
+
+    def features(self, algorithm, shape, kernel_size, dtype=np.uint8):
+        """
+        Computes the sizes that the footprint of a job scales with.
+
+        :param algorithm: Either "richardson_lucy" or "blind_richardson_lucy".
+        :type algorithm: str
+        :param shape: The shape of the image, (height, width) or (height, width, channels).
+        :type shape: tuple
+        :param kernel_size: The size of the (initial) PSF.
+        :type kernel_size: int
+        :param dtype: The dtype of the input image, defaults to uint8.
+        :type dtype: numpy.dtype
+        :return: The features, in bytes.
+        :rtype: numpy.ndarray
+        :raises ValueError: If the algorithm is unknown.
+        """
+        if algorithm not in self.coefficients:
+            raise ValueError(f"Unknown algorithm: {algorithm}.")
+
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) == 3 else 1
+        float_size = np.dtype(np.float64).itemsize
+        return np.array(
+            [
+                1.0,
+                height * width * channels * np.dtype(dtype).itemsize,
+                height * width * channels * float_size,
+                (height + kernel_size) * (width + kernel_size) * float_size,
+                # np.savez_compressed writes the estimate in chunks of at most 16 MiB
+                min(height * width * channels * float_size, 16 * 2**20),
+            ]
+        )
+
+    def estimate(self, algorithm, shape, kernel_size, dtype=np.uint8):
+        """
+        Estimates the peak memory footprint of a job.
+
+        :param algorithm: Either "richardson_lucy" or "blind_richardson_lucy".
+        :type algorithm: str
+        :param shape: The shape of the image.
+        :type shape: tuple
+        :param kernel_size: The size of the (initial) PSF.
+        :type kernel_size: int
+        :param dtype: The dtype of the input image, defaults to uint8.
+        :type dtype: numpy.dtype
+        :return: The estimated peak, in bytes.
+        :rtype: int
+        """
+        features = self.features(algorithm, shape, kernel_size, dtype)
+        estimate = float(features @ self.coefficients[algorithm])
+        return int(estimate) + self.margins[algorithm]
+
+    def observe(self, algorithm, estimate, peak):
+        """
+        Accounts for the measured peak of a job, so that later estimates of the algorithm add at least the amount
+        it exceeded its estimate by.
+
+        :param algorithm: The algorithm of the job.
+        :type algorithm: str
+        :param estimate: The estimate the job was admitted with, in bytes.
+        :type estimate: int
+        :param peak: The measured peak, in bytes.
+        :type peak: int
+        """
+        if peak > estimate:
+            self.margins[algorithm] += int(peak - estimate)
+
+    def calibrate(
+        self,
+        algorithm,
+        job=None,
+        shapes=((256, 256, 3), (512, 640, 3), (720, 1080, 3), (908, 1280, 3)),
+        kernel_sizes=(3, 21),
+        dtypes=(np.uint8, np.float32),
+    ):
+        """
+        Fits the coefficients of an algorithm to the measured peaks of jobs on random images, e.g. after
+        upgrading numpy or scipy. Each probe runs in a new process, and its peak is the larger of its
+        `tracemalloc` and resident peaks (see `measure_peak_memory`). The probes cover every combination of
+        shape, kernel size and dtype, so that every feature can be fitted. The constant is then raised until no
+        probe is underestimated, and every coefficient by 5%, since the resident peak of a job varies by a few
+        percent with the content of its image.
+
+        The default coefficients were fitted on the jobs the drivers hand to the scheduler, which also blur the
+        image, compute the PSNR, write a checkpoint and save PNG images around the deconvolution. Pass such a
+        job to refit them, e.g. a driver's `process_image` writing to a temporary folder. Without one, the
+        probes only time the deconvolution, with two iterations since the footprint does not depend on them.
+
+        :param algorithm: Either "richardson_lucy" or "blind_richardson_lucy".
+        :type algorithm: str
+        :param job: Optional function of a random image and a kernel (a `Kernel`), defined at module level so
+            that worker processes can run it. Defaults to None, the deconvolution alone.
+        :type job: callable
+        :param shapes: The image shapes of the probes.
+        :type shapes: tuple
+        :param kernel_sizes: The kernel sizes of the probes.
+        :type kernel_sizes: tuple
+        :param dtypes: The dtypes of the probe images.
+        :type dtypes: tuple
+        :return: The measured peaks, in bytes, for each shape, kernel size and dtype.
+        :rtype: list
+        """
+        if job is None:
+            job = partial(_deconvolve, algorithm)
+
+        random = np.random.default_rng(0)
+        features = []
+        peaks = []
+        for shape in shapes:
+            pixels = random.integers(0, 256, shape)
+            for kernel_size in kernel_sizes:
+                for dtype in dtypes:
+                    with _fresh_process_executor(1) as executor:
+                        _, peak, resident_peak, _ = executor.submit(
+                            _run_measured,
+                            job,
+                            (pixels.astype(dtype), kernel_average(kernel_size)),
+                        ).result()
+                    features.append(self.features(algorithm, shape, kernel_size, dtype))
+                    peaks.append(max(peak, resident_peak or 0))
+
+        # Non-negative least squares, since a negative coefficient is meaningless for a footprint
+        features = np.array(features)
+        peaks = np.array(peaks, dtype=np.float64)
+        coefficients = nnls(features, peaks)[0]
+        # The first jobs are admitted before any is measured, so the fit must not underestimate the probes
+        coefficients[0] += max(0.0, np.max(peaks - features @ coefficients))
+        coefficients *= 1.05
+
+        self.coefficients[algorithm] = coefficients
+        self.margins[algorithm] = 0
+        return [int(peak) for peak in peaks]
+
+
+class MemoryJob:
+    def __init__(self, name, function, args, algorithm, shape, kernel_size, dtype=np.uint8):
+        """
+        A job of a sweep, and what its footprint is estimated from.
+
+        :param name: The name of the job, for the records.
+        :type name: str
+        :param function: The function to run in a worker process, which must be picklable with its arguments.
+        :type function: callable
+        :param args: The arguments of the function.
+        :type args: tuple
+        :param algorithm: Either "richardson_lucy" or "blind_richardson_lucy".
+        :type algorithm: str
+        :param shape: The shape of the image.
+        :type shape: tuple
+        :param kernel_size: The size of the (initial) PSF.
+        :type kernel_size: int
+        :param dtype: The dtype of the input image, defaults to uint8.
+        :type dtype: numpy.dtype
+        """
+        self.name = name
+        self.function = function
+        self.args = args
+        self.algorithm = algorithm
+        self.shape = tuple(shape)
+        self.kernel_size = kernel_size
+        self.dtype = dtype
+
+
+class MemoryBudgetScheduler:
+    def __init__(self, budget, workers=None, model=None):
+        """
+        Runs the jobs of a sweep in worker processes, concurrently only while the sum of their estimated peak
+        footprints fits in a memory budget. Each job runs in a new process, where both its `tracemalloc` peak
+        and its resident peak are measured, recorded and fed back into the model.
+
+        A job estimated above the whole budget still runs, but alone.
+
+        :param budget: The memory budget, in bytes.
+        :type budget: int
+        :param workers: Maximum number of concurrent jobs, defaults to None (the number of processors).
+        :type workers: int
+        :param model: The memory model, defaults to a `MemoryModel` with the default coefficients.
+        :type model: MemoryModel
+        """
+        self.budget = budget
+        self.workers = workers
+        self.model = model if model is not None else MemoryModel()
+        self.records = []
+
+    def run(self, jobs, on_record=None):
+        """
+        Runs jobs, admitting them in order as soon as they fit in the budget. A smaller job may start before a
+        larger one that is still waiting for memory.
+
+        :param jobs: The jobs to run.
+        :type jobs: list
+        :param on_record: Optional function called with each record as soon as its job is done.
+        :type on_record: callable
+        :return: One record per job, in the order of the jobs: its name, algorithm, estimated peak, `tracemalloc`
+            peak and resident peak (in bytes, the latter None where unavailable) and duration (in seconds).
+        :rtype: list
+        :raises Exception: The first failure of a job, once the running jobs are done.
+        """
+        waiting = deque(enumerate(jobs))
+        running = {}
+        records = [None] * len(jobs)
+        in_use = 0
+        error = None
+
+        max_running = self.workers if self.workers is not None else os.cpu_count()
+        with _fresh_process_executor(max_running) as executor:
+            while running or (waiting and error is None):
+                # Admission, in order, of the jobs that fit next to the running ones
+                for position, job in list(waiting) if error is None else []:
+                    if len(running) >= max_running:
+                        break
+                    estimate = self.model.estimate(
+                        job.algorithm, job.shape, job.kernel_size, job.dtype
+                    )
+                    if running and in_use + estimate > self.budget:
+                        continue
+                    waiting.remove((position, job))
+                    future = executor.submit(_run_measured, job.function, job.args)
+                    running[future] = (position, job, estimate)
+                    in_use += estimate
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    position, job, estimate = running.pop(future)
+                    in_use -= estimate
+                    try:
+                        _, peak, resident_peak, duration = future.result()
+                    except Exception as job_error:
+                        # Stop admitting jobs, and let the running ones finish
+                        error = error or job_error
+                        continue
+
+                    self.model.observe(job.algorithm, estimate, max(peak, resident_peak or 0))
+                    record = {
+                        "name": job.name,
+                        "algorithm": job.algorithm,
+                        "estimate": estimate,
+                        "peak": peak,
+                        "resident_peak": resident_peak,
+                        "duration": duration,
+                    }
+                    records[position] = record
+                    self.records.append(record)
+                    if on_record is not None:
+                        on_record(record)
+
+        if error is not None:
+            raise error
+        return records
+
+
+def measure_peak_memory(function, *args, **kwargs):
+    """
+    Runs a function and measures its peak memory in two ways: the peak of what it allocates through Python,
+    numpy arrays included, with `tracemalloc`, and how far it raises the resident high-water mark of the process
+    (`ru_maxrss`), which also covers the native buffers `tracemalloc` does not see, e.g. those of pocketfft, FFTW
+    or PIL. The resident peak is only the function's own in a process that has not peaked higher before, such as
+    a new one.
+
+    :param function: The function to run.
+    :type function: callable
+    :return: The result of the function, its `tracemalloc` peak and its resident peak, in bytes. The resident
+        peak is None where the `resource` module is unavailable.
+    :rtype: tuple
+    """
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    resident_baseline = _max_resident_memory()
+    try:
+        result = function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        if not already_tracing:
+            tracemalloc.stop()
+
+    resident_peak = None
+    if resident_baseline is not None:
+        resident_peak = _max_resident_memory() - resident_baseline
+    return result, peak, resident_peak
+
+
+def _max_resident_memory():
+    """
+    Reads the resident memory high-water mark of the current process.
+
+    :return: The high-water mark in bytes, or None where the `resource` module is unavailable.
+    :rtype: int
+    """
+    if resource is None:
+        return None
+    max_resident = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_resident if sys.platform == "darwin" else max_resident * 1024
+
+
+def _fresh_process_executor(max_workers):
+    """
+    Creates a process pool that runs every job in a new process, so that its resident peak is its own. Python
+    3.10 and older cannot, and reuse processes instead.
+
+    :param max_workers: The maximum number of processes.
+    :type max_workers: int
+    :return: The process pool.
+    :rtype: concurrent.futures.ProcessPoolExecutor
+    """
+    if sys.version_info >= (3, 11):
+        return ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=1)
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def _deconvolve(algorithm, image, kernel_obj):
+    """
+    Deconvolves an image with two iterations, the default job of `MemoryModel.calibrate`.
+
+    :param algorithm: Either "richardson_lucy" or "blind_richardson_lucy".
+    :param image: The image.
+    :param kernel_obj: The kernel, or initial PSF in blind mode.
+    """
+    if algorithm == "richardson_lucy":
+        FastRichardsonLucy(image, kernel_obj.kernel, 2).apply()
+    else:
+        FastBlindRichardsonLucy(image, kernel_obj.kernel, 2, 2).apply()
+
+
+def _run_measured(function, args):
+    """
+    Runs a job in a worker process and measures it.
+
+    :param function: The function of the job.
+    :param args: Its arguments.
+    :return: The result, the `tracemalloc` and resident peaks in bytes, and the duration in seconds.
+    :rtype: tuple
+    """
+    start_time = time.perf_counter()
+    result, peak, resident_peak = measure_peak_memory(function, *args)
+    return result, peak, resident_peak, time.perf_counter() - start_time
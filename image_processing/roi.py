@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def roi_halo(psf_shape, iterations):
+    """
+    Computes the halo needed around a region of interest so that deconvolving the region alone gives the
+    same result inside it as deconvolving the whole image.
+
+    Each Richardson-Lucy iteration convolves twice with the PSF (once with the PSF, once with its mirror),
+    so a pixel only depends on pixels within twice the PSF radius per iteration.
+
+    :param psf_shape: The shape of the PSF.
+    :type psf_shape: tuple
+    :param iterations: The number of Richardson-Lucy iterations.
+    :type iterations: int
+    :return: The halo width, in pixels.
+    :rtype: int
+    """
+    radius = max(psf_shape) // 2
+    return 2 * radius * iterations
+
+
+def crop_with_halo(image, box, halo):
+    """
+    Crops a region of interest and its halo out of an image. The image is treated as periodic, like the
+    wrap boundary of the deconvolvers, so a halo crossing an edge continues on the opposite side.
+
+    :param image: A 2D (grayscale) or 3D (color) numpy array.
+    :type image: numpy.ndarray
+    :param box: The region of interest as a (left, upper, right, lower) tuple, like PIL boxes.
+    :type box: tuple
+    :param halo: The halo width, in pixels.
+    :type halo: int
+    :return: The cropped region, of shape (lower - upper + 2 * halo, right - left + 2 * halo).
+    :rtype: numpy.ndarray
+    """
+    left, upper, right, lower = box
+    rows = np.arange(upper - halo, lower + halo) % image.shape[0]
+    columns = np.arange(left - halo, right + halo) % image.shape[1]
+    return image[rows][:, columns]
+
+
+def deconvolve_rois(image, boxes, halo, deconvolve):
+    """
+    Deconvolves only some regions of interest of an image and pastes them back into it. Each region is
+    deconvolved together with its halo, which is then discarded, so the cost scales with the area of the
+    regions instead of the image.
+
+    :param image: A 2D (grayscale) or 3D (color) numpy array.
+    :type image: numpy.ndarray
+    :param boxes: The regions of interest, as (left, upper, right, lower) tuples.
+    :type boxes: list
+    :param halo: The halo width, in pixels, usually from `roi_halo`.
+    :type halo: int
+    :param deconvolve: A function deconvolving an image crop and returning it as a float64 numpy array. When a
+        halo covers the whole image, it receives the image itself instead of a crop.
+    :type deconvolve: callable
+    :return: A float64 copy of the image where the regions of interest are deconvolved.
+    :rtype: numpy.ndarray
+    :raises ValueError: If a box is empty or does not fit in the image.
+    """
+    height, width = image.shape[:2]
+    result = np.array(image, dtype=np.float64)
+    full_image = None
+
+    for box in boxes:
+        left, upper, right, lower = box
+        if not (0 <= left < right <= width and 0 <= upper < lower <= height):
+            raise ValueError(f"Box {box} is empty or outside of the image.")
+
+        crop_area = (right - left + 2 * halo) * (lower - upper + 2 * halo)
+        if crop_area >= height * width:
+            # The halo covers the whole image, processing it once is cheaper
+            if full_image is None:
+                full_image = deconvolve(image)
+            result[upper:lower, left:right] = full_image[upper:lower, left:right]
+        else:
+            deconvolved_crop = deconvolve(crop_with_halo(image, box, halo))
+            result[upper:lower, left:right] = deconvolved_crop[
+                halo : halo + lower - upper, halo : halo + right - left
+            ]
+
+    return result
@@ -0,0 +1,140 @@
+import numpy as np
+from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.fast_blind_richardson_lucy import FastBlindRichardsonLucy
+from image_processing.fft_backend import get_fft_backend
+
+
+class SequenceRichardsonLucy:
+    def __init__(
+        self,
+        psf,
+        iterations=30,
+        warm_iterations=10,
+        psf_iterations=None,
+        change_threshold=12,
+    ):
+        """
+        Streaming Richardson-Lucy deconvolution for video or frame sequences. Neighboring frames are nearly
+        identical, so every frame after the first starts from the previous frame's converged estimate (where
+        the content matches) and, in blind mode, from the previous frame's refined PSF. Warm-started frames
+        then only need `warm_iterations` instead of the full `iterations`.
+
+        :param psf: The Point Spread Function of the blur, or the initial guess in blind mode, as a 2D numpy array.
+        :type psf: numpy.ndarray
+        :param iterations: Number of iterations for the first frame (and after a reset), defaults to 30.
+        :type iterations: int
+        :param warm_iterations: Number of iterations for warm-started frames, defaults to 10.
+        :type warm_iterations: int
+        :param psf_iterations: Number of PSF refinement iterations. When set, the blind deconvolver is used
+            and the refined PSF is carried from frame to frame. Defaults to None (non-blind).
+        :type psf_iterations: int
+        :param change_threshold: Maximum absolute pixel difference between two frames for the previous
+            estimate to be reused at that pixel. Pixels that changed more restart from the new frame.
+        :type change_threshold: float
+        """
+        self.initial_psf = np.array(psf, dtype=np.float64)
+        self.iterations = iterations
+        self.warm_iterations = warm_iterations
+        self.psf_iterations = psf_iterations
+        self.change_threshold = change_threshold
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets the previous frame, e.g. on a scene cut. The next frame is deconvolved from scratch with the
+        initial PSF and the full number of iterations.
+        """
+        self.psf = np.copy(self.initial_psf)
+        self.previous_frame = None
+        self.previous_estimate = None
+
+    def process_frame(self, frame):
+        """
+        Deblurs the next frame of the sequence.
+
+        :param frame: The next blurry frame, with the same shape as the previous ones.
+        :type frame: numpy.ndarray
+        :return: The deblurred frame.
+        :rtype: numpy.ndarray
+        :raises ValueError: If the frame shape differs from the previous frame.
+        """
+        if self.previous_frame is None:
+            iterations = self.iterations
+            initial_estimate = None
+        else:
+            if frame.shape != self.previous_frame.shape:
+                raise ValueError("All frames of a sequence must have the same shape.")
+            iterations = self.warm_iterations
+            initial_estimate = self._warm_start(frame)
+
+        if self.psf_iterations is None:
+            deconvolver = FastRichardsonLucy(
+                frame, self.psf, iterations, initial_estimate=initial_estimate
+            )
+        else:
+            deconvolver = FastBlindRichardsonLucy(
+                frame,
+                self.psf,
+                iterations,
+                self.psf_iterations,
+                initial_estimate=initial_estimate,
+            )
+        deblurred_frame = deconvolver.apply()
+
+        if self.psf_iterations is not None:
+            # Carry the refined PSF over to the next frame
+            self.psf = deconvolver.psf
+        self.previous_frame = frame.astype(np.float64)
+        self.previous_estimate = deconvolver.estimate
+
+        return deblurred_frame
+
+    def process(self, frames):
+        """
+        Deblurs an iterable of frames lazily, one frame at a time.
+
+        :param frames: The frames of the sequence, in display order.
+        :return: A generator yielding the deblurred frames in the same order.
+        """
+        for frame in frames:
+            yield self.process_frame(frame)
+
+    def _warm_start(self, frame):
+        """
+        Builds the initial estimate of a frame from the previous frame's estimate where the content matches,
+        and from the frame itself elsewhere. The previous frame is first aligned on the new one to follow
+        camera pans.
+
+        :param frame: The new blurry frame.
+        :return: The initial estimate as a float64 numpy array.
+        """
+        frame = frame.astype(np.float64)
+        shift = self._estimate_shift(self.previous_frame, frame)
+        previous_frame = np.roll(self.previous_frame, shift, axis=(0, 1))
+        previous_estimate = np.roll(self.previous_estimate, shift, axis=(0, 1))
+
+        unchanged = np.abs(frame - previous_frame) <= self.change_threshold
+        return np.where(unchanged, previous_estimate, frame)
+
+    def _estimate_shift(self, previous_frame, frame):
+        """
+        Estimates the global integer translation between two frames by phase correlation.
+
+        :param previous_frame: The previous frame.
+        :param frame: The new frame.
+        :return: The (rows, columns) shift to apply to the previous frame with numpy.roll.
+        """
+        if frame.ndim == 3:
+            previous_frame = np.mean(previous_frame, axis=2)
+            frame = np.mean(frame, axis=2)
+
+        fft_backend = get_fft_backend()
+        cross_power = fft_backend.rfft2(frame) * np.conj(fft_backend.rfft2(previous_frame))
+        cross_power /= np.abs(cross_power) + 1e-12
+        correlation = fft_backend.irfft2(cross_power, frame.shape)
+        peak = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+        # Peaks past the middle correspond to negative shifts
+        return tuple(
+            int(p - n) if p > n // 2 else int(p) for p, n in zip(peak, frame.shape)
+        )
@@ -0,0 +1,131 @@
+import numpy as np
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+
+class SharedArray:
+    def __init__(self, name, shape, dtype):
+        """
+        Describes a numpy array stored in a shared memory segment. Only this description is sent to worker
+        processes, which then map the array without copying it.
+
+        :param name: The name of the shared memory segment.
+        :type name: str
+        :param shape: The shape of the array.
+        :type shape: tuple
+        :param dtype: The dtype of the array.
+        :type dtype: numpy.dtype
+        """
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    def __repr__(self):
+        return f"SharedArray({self.name!r}, {self.shape}, {self.dtype})"
+
+
+class SharedArrayPool:
+    def __init__(self):
+        """
+        Owns a set of shared memory segments holding numpy arrays, e.g. decoded images and result buffers
+        shared with worker processes.
+
+        Use it as a context manager: every segment is unlinked when the block exits, including when a worker
+        crashed or an exception was raised, so no segment outlives the run.
+        """
+        self._segments = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def create(self, shape, dtype=np.float64):
+        """
+        Allocates a zero-filled array in a new shared memory segment, e.g. a result buffer for a worker.
+
+        :param shape: The shape of the array.
+        :type shape: tuple
+        :param dtype: The dtype of the array, defaults to float64.
+        :type dtype: numpy.dtype
+        :return: The description to send to workers, and the array itself.
+        :rtype: tuple
+        """
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        segment = shared_memory.SharedMemory(create=True, size=size)
+        self._segments[segment.name] = segment
+
+        descriptor = SharedArray(segment.name, shape, dtype)
+        array = np.ndarray(descriptor.shape, dtype=dtype, buffer=segment.buf)
+        array[...] = 0
+        return descriptor, array
+
+    def share(self, array):
+        """
+        Copies an array into a new shared memory segment.
+
+        :param array: The array to share.
+        :type array: numpy.ndarray
+        :return: The description to send to workers.
+        :rtype: SharedArray
+        """
+        descriptor, shared = self.create(array.shape, array.dtype)
+        shared[...] = array
+        return descriptor
+
+    def array(self, descriptor):
+        """
+        Maps an array of this pool, without copying it.
+
+        :param descriptor: The description of the array.
+        :type descriptor: SharedArray
+        :return: The array, valid until the pool is closed.
+        :rtype: numpy.ndarray
+        """
+        segment = self._segments[descriptor.name]
+        return np.ndarray(descriptor.shape, dtype=descriptor.dtype, buffer=segment.buf)
+
+    def close(self):
+        """
+        Releases and unlinks every segment of the pool.
+        """
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # Arrays mapping the segment are still alive: the memory is released with them
+                pass
+            segment.unlink()
+        self._segments = {}
+
+
+@contextmanager
+def attach(descriptor):
+    """
+    Maps a shared array in a worker process, without copying it. The array must not be used after the block.
+
+    The segment is only closed, never unlinked, by workers: its lifetime belongs to the `SharedArrayPool`
+    of the parent process.
+
+    :param descriptor: The description of the array.
+    :type descriptor: SharedArray
+    :return: A context manager yielding the array.
+    """
+    try:
+        # Python 3.13+: do not let the worker's resource tracker unlink the parent's segment
+        segment = shared_memory.SharedMemory(name=descriptor.name, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(name=descriptor.name)
+
+    array = np.ndarray(descriptor.shape, dtype=descriptor.dtype, buffer=segment.buf)
+    try:
+        yield array
+    finally:
+        del array
+        try:
+            segment.close()
+        except BufferError:
+            # A view of the array escaped the block: the mapping is released with it
+            pass
@@ -0,0 +1,253 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.fast_blind_richardson_lucy import FastBlindRichardsonLucy
+from image_processing.fft_backend import get_fft_backend
+from image_processing.roi import roi_halo, crop_with_halo
+from image_processing.shared_arrays import SharedArrayPool, attach
+
+
+class TiledRichardsonLucy:
+    def __init__(
+        self,
+        image,
+        psf_grid,
+        iterations=10,
+        overlap=16,
+        psf_iterations=None,
+        workers=1,
+        threads=1,
+    ):
+        """
+        Initializes a Richardson-Lucy deconvolution with a spatially-varying PSF, e.g. lens or motion blur that
+        changes across the field. The image is split into a grid of regions, one per PSF, and each region is
+        deconvolved with its own PSF. Regions are independent, so they run in parallel, and their results are
+        blended with smooth weights across the overlaps.
+
+        :param image: The blurry and noisy image to be deblurred. Can be a 2D (grayscale) or 3D (color) numpy array.
+        :type image: numpy.ndarray
+        :param psf_grid: The PSFs as a list of rows, e.g. [[top_left, top_right], [bottom_left, bottom_right]].
+            In blind mode they are the initial guesses, and can all be the same PSF.
+        :type psf_grid: list
+        :param iterations: The number of iterations to run the deconvolution algorithm, defaults to 10.
+        :type iterations: int
+        :param overlap: Number of pixels each region extends into its neighbors for blending, defaults to 16.
+        :type overlap: int
+        :param psf_iterations: Number of PSF refinement iterations. When set, each region estimates its own PSF
+            with the blind deconvolver. Defaults to None (non-blind).
+        :type psf_iterations: int
+        :param workers: Number of processes deconvolving regions in parallel, defaults to 1.
+        :type workers: int
+        :param threads: Number of threads deconvolving regions in parallel, when `workers` is 1, defaults to 1.
+            Threads avoid starting processes, which suits a single latency-sensitive image.
+        :type threads: int
+        :raises ValueError: If the grid is empty or has more regions than pixels.
+        """
+        self.image = image
+        self.psf_grid = [[np.asarray(psf) for psf in row] for row in psf_grid]
+        self.iterations = iterations
+        self.overlap = overlap
+        self.psf_iterations = psf_iterations
+        self.workers = workers
+        self.threads = threads
+        self.estimated_psf_grid = None  # Refined PSFs, in blind mode
+
+        grid_rows = len(self.psf_grid)
+        grid_columns = len(self.psf_grid[0]) if grid_rows else 0
+        if grid_rows == 0 or grid_columns == 0:
+            raise ValueError("The PSF grid must contain at least one PSF.")
+        if any(len(row) != grid_columns for row in self.psf_grid):
+            raise ValueError("All rows of the PSF grid must have the same length.")
+        if grid_rows > image.shape[0] or grid_columns > image.shape[1]:
+            raise ValueError("The PSF grid has more regions than the image has pixels.")
+
+        # Region boundaries, as even as possible
+        self.row_edges = np.linspace(0, image.shape[0], grid_rows + 1).astype(int)
+        self.column_edges = np.linspace(0, image.shape[1], grid_columns + 1).astype(int)
+
+    def apply(self):
+        """
+        Deblurs the image region by region and blends the results.
+
+        :return: The deblurred image, with the same dimensions as the input image.
+        :rtype: numpy.ndarray
+        """
+        jobs = []
+        regions = []
+        # When regions already run in parallel, each FFT stays on a single thread
+        fft_workers = 1 if self.workers > 1 or self.threads > 1 else None
+        for i, row in enumerate(self.psf_grid):
+            for j, psf in enumerate(row):
+                # Blending region: the grid cell extended by the overlap on every side
+                box = (
+                    self.column_edges[j] - self.overlap,
+                    self.row_edges[i] - self.overlap,
+                    self.column_edges[j + 1] + self.overlap,
+                    self.row_edges[i + 1] + self.overlap,
+                )
+                halo = roi_halo(psf.shape, self.iterations)
+                jobs.append(
+                    (box, psf, self.iterations, self.psf_iterations, halo, fft_workers)
+                )
+                regions.append(box)
+
+        if self.workers > 1:
+            with SharedArrayPool() as pool:
+                # Workers map the image and write their region into a result buffer, so neither is pickled
+                image = pool.share(self.image)
+                buffers = [
+                    pool.create((box[3] - box[1], box[2] - box[0]) + self.image.shape[2:])
+                    for box in regions
+                ]
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    futures = [
+                        executor.submit(_deconvolve_shared_region, image, descriptor, *job)
+                        for job, (descriptor, _) in zip(jobs, buffers)
+                    ]
+                    psfs = [future.result() for future in futures]
+                accumulated, weights = self._blend_all(
+                    regions, [estimate for _, estimate in buffers]
+                )
+        else:
+            if self.threads > 1:
+                with ThreadPoolExecutor(max_workers=self.threads) as executor:
+                    results = list(
+                        executor.map(
+                            lambda job: _deconvolve_region(self.image, *job), jobs
+                        )
+                    )
+            else:
+                results = [_deconvolve_region(self.image, *job) for job in jobs]
+            psfs = [psf for _, psf in results]
+            accumulated, weights = self._blend_all(
+                regions, [estimate for estimate, _ in results]
+            )
+
+        if self.image.ndim == 3:
+            weights = weights[:, :, np.newaxis]
+        deblurred_image = accumulated / weights
+
+        grid_columns = len(self.psf_grid[0])
+        self.estimated_psf_grid = [
+            psfs[i : i + grid_columns] for i in range(0, len(psfs), grid_columns)
+        ]
+
+        if self.psf_iterations is not None:
+            return deblurred_image.astype(np.uint8)
+        return deblurred_image
+
+    def _blend_all(self, regions, estimates):
+        """
+        Sums the deconvolved regions with their blending weights.
+
+        :param regions: The blending regions, as (left, upper, right, lower) tuples.
+        :type regions: list
+        :param estimates: The deconvolved blending regions, in the same order.
+        :type estimates: list
+        :return: The weighted sum of the regions, and the sum of the weights.
+        :rtype: tuple
+        """
+        accumulated = np.zeros(self.image.shape, dtype=np.float64)
+        weights = np.zeros(self.image.shape[:2], dtype=np.float64)
+        for box, estimate in zip(regions, estimates):
+            self._blend(accumulated, weights, estimate, box)
+        return accumulated, weights
+
+    def _blend(self, accumulated, weights, estimate, box):
+        """
+        Adds a deconvolved region to the weighted sum of the image, with weights that fall smoothly to zero
+        across the overlap. Raised cosine ramps of neighboring regions sum to one, so the seams are invisible.
+
+        :param accumulated: The weighted sum of the deconvolved regions, updated in place.
+        :param weights: The sum of the weights, updated in place.
+        :param estimate: The deconvolved blending region.
+        :param box: The blending region as a (left, upper, right, lower) tuple, possibly crossing the image edges.
+        """
+        left, upper, right, lower = box
+        region_weights = np.outer(
+            self._ramp(lower - upper), self._ramp(right - left)
+        )
+
+        # Regions crossing an edge wrap around, like the deconvolution boundary
+        rows = np.arange(upper, lower) % accumulated.shape[0]
+        columns = np.arange(left, right) % accumulated.shape[1]
+        index = np.ix_(rows, columns)
+        if estimate.ndim == 3:
+            np.add.at(accumulated, index, estimate * region_weights[:, :, np.newaxis])
+        else:
+            np.add.at(accumulated, index, estimate * region_weights)
+        np.add.at(weights, index, region_weights)
+
+    def _ramp(self, length):
+        """
+        Builds a 1D blending weight: a raised cosine rising over the first 2 * overlap pixels, flat in the
+        middle, and falling over the last 2 * overlap pixels.
+
+        :param length: The length of the blending region, including the overlap on both sides.
+        :type length: int
+        :return: The weights, as a 1D numpy array.
+        :rtype: numpy.ndarray
+        """
+        ramp = np.ones(length)
+        width = 2 * self.overlap
+        if width > 0:
+            rising = 0.5 - 0.5 * np.cos(np.pi * (np.arange(width) + 0.5) / width)
+            ramp[:width] = rising
+            ramp[-width:] = rising[::-1]
+        return ramp
+
+
+def _deconvolve_region(image, box, psf, iterations, psf_iterations, halo, fft_workers):
+    """
+    Deconvolves one region of a tiled deconvolution.
+
+    :param image: The whole image.
+    :param box: The blending region as a (left, upper, right, lower) tuple, possibly crossing the image edges.
+    :param psf: The PSF of the region, or its initial guess in blind mode.
+    :param iterations: The number of Richardson-Lucy iterations.
+    :param psf_iterations: The number of PSF refinement iterations, or None for non-blind deconvolution.
+    :param halo: The halo width, discarded from the result.
+    :param fft_workers: Number of threads per FFT when regions run in parallel, or None when they run one after
+        another: blind deconvolutions then use every core, and non-blind ones `scipy.signal.convolve2d`.
+    :return: The deconvolved blending region, as float64, and the (refined) PSF.
+    :rtype: tuple
+    """
+    crop = crop_with_halo(image, box, halo)
+    if psf_iterations is None:
+        # convolve2d holds the GIL, so regions running in threads convolve through the FFT instead
+        fft_backend = get_fft_backend(workers=fft_workers) if fft_workers is not None else None
+        deconvolver = FastRichardsonLucy(crop, psf, iterations, fft_backend=fft_backend)
+    else:
+        deconvolver = FastBlindRichardsonLucy(
+            crop,
+            psf,
+            iterations,
+            psf_iterations,
+            fft_backend=get_fft_backend(workers=fft_workers),
+        )
+    deconvolver.apply()
+
+    estimate = deconvolver.estimate[
+        halo : crop.shape[0] - halo, halo : crop.shape[1] - halo
+    ]
+    return estimate, np.asarray(deconvolver.psf, dtype=np.float64)
+
+
+def _deconvolve_shared_region(image, result, box, *args):
+    """
+    Deconvolves one region of a tiled deconvolution in a worker process, reading the image from shared memory
+    and writing the blending region to the shared result buffer.
+
+    :param image: The whole image, in shared memory.
+    :type image: SharedArray
+    :param result: The buffer receiving the deconvolved blending region, in shared memory.
+    :type result: SharedArray
+    :param box: The blending region, as in `_deconvolve_region`.
+    :param args: The remaining arguments of `_deconvolve_region`.
+    :return: The (refined) PSF.
+    :rtype: numpy.ndarray
+    """
+    with attach(image) as shared_image, attach(result) as shared_result:
+        estimate, psf = _deconvolve_region(shared_image, box, *args)
+        shared_result[...] = estimate
+    return psf
@@ -12,6 +12,8 @@ echo -e "1) ${GREEN}Run core${NC}"
 echo -e "2) ${GREEN}Run Fast core${NC}"
 echo -e "3) ${GREEN}Run Fast blind core${NC}"
 echo -e "4) ${GREEN}Run both fast core and fast blind core${NC}"
+echo -e "5) ${GREEN}Run Fast sequence core${NC}"
+echo -e "6) ${GREEN}Run Fast deblur service${NC}"
 read -p "Enter option: " option
 
 # Path to Python scripts
@@ -19,6 +21,8 @@ ACTIVATE_VENV="source blur_image_env/bin/activate"
 CORE_SCRIPT="python3 core.py"
 FAST_CORE_SCRIPT="python3 fast_core.py"
 FAST_BLIND_CORE_SCRIPT="python3 fast_blind_core.py"
+FAST_SEQUENCE_CORE_SCRIPT="python3 fast_sequence_core.py"
+FAST_SERVICE_SCRIPT="python3 fast_service.py"
 
 # Execute based on user input
 case $option in
@@ -44,6 +48,16 @@ case $option in
         $FAST_BLIND_CORE_SCRIPT
         $BLIND_CORE_SCRIPT
         ;;
+    5)
+        echo -e "${YELLOW}Running fast_sequence_core...${NC}"
+        $ACTIVATE_VENV
+        $FAST_SEQUENCE_CORE_SCRIPT
+        ;;
+    6)
+        echo -e "${YELLOW}Running fast_service...${NC}"
+        $ACTIVATE_VENV
+        $FAST_SERVICE_SCRIPT
+        ;;
     *)
         echo -e "${RED}Invalid option selected. Exiting.${NC}"
         exit 1
@@ -0,0 +1,92 @@
+import threading
+import unittest
+import urllib.error
+import numpy as np
+from image_processing.batch_richardson_lucy import BatchRichardsonLucy
+from image_processing.deblur_service import (
+    DeblurService,
+    ServiceBusyError,
+    request_deblur,
+)
+from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.kernels import kernel_gaussian
+
+
+class TestBatchRichardsonLucy(unittest.TestCase):
+    def test_batch_matches_one_image_at_a_time(self):
+        random = np.random.default_rng(0)
+        images = [
+            random.integers(0, 256, (40, 56, 3)).astype(np.uint8) for _ in range(3)
+        ]
+        psf = kernel_gaussian(5, 1.0).kernel
+
+        results = BatchRichardsonLucy(images, psf, 10).apply()
+        for image, result in zip(images, results):
+            np.testing.assert_allclose(
+                result, FastRichardsonLucy(image, psf, 10).apply(), rtol=0, atol=1e-9
+            )
+
+
+class TestDeblurService(unittest.TestCase):
+    def setUp(self):
+        random = np.random.default_rng(0)
+        self.images = [
+            random.integers(0, 256, (32, 48, 3)).astype(np.uint8) for _ in range(4)
+        ]
+        self.parameters = {"kernel": "gaussian", "size": 5, "sigma": 1.0, "iterations": 5}
+
+    def start(self, **options):
+        service = DeblurService(port=0, **options).start()
+        self.addCleanup(service.stop)
+        host, port = service.address
+        return service, f"http://{host}:{port}"
+
+    def test_concurrent_requests_are_batched(self):
+        service, url = self.start(batch_window=1.0, max_batch_size=len(self.images))
+        results = [None] * len(self.images)
+
+        def send(i):
+            results[i] = request_deblur(url, self.images[i], **self.parameters)
+
+        threads = [
+            threading.Thread(target=send, args=(i,)) for i in range(len(self.images))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = service.stats()
+        self.assertEqual(stats["completed"], len(self.images))
+        self.assertEqual(stats["batches"], 1)
+        psf = kernel_gaussian(5, 1.0).kernel
+        for image, result in zip(self.images, results):
+            np.testing.assert_allclose(
+                result, FastRichardsonLucy(image, psf, 5).apply(), rtol=0, atol=1e-9
+            )
+
+    def test_requests_beyond_max_pending_are_rejected(self):
+        # The first request waits out the long batch window, so it stays pending
+        service, url = self.start(batch_window=2.0, max_pending=1)
+        first = threading.Thread(
+            target=request_deblur, args=(url, self.images[0]), kwargs=self.parameters
+        )
+        first.start()
+        while service.stats()["pending"] < 1:
+            first.join(0.01)
+
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            request_deblur(url, self.images[1], **self.parameters)
+        self.assertEqual(context.exception.code, 503)
+        self.assertEqual(context.exception.headers["Retry-After"], "1")
+        with self.assertRaises(ServiceBusyError):
+            service.submit(self.images[1], **self.parameters)
+
+        first.join()
+        stats = service.stats()
+        self.assertEqual(stats["rejected"], 2)
+        self.assertEqual(stats["completed"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
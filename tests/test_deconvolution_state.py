@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from image_processing.deconvolution_state import save_state, find_resumable_state
+from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.kernels import kernel_gaussian
+
+
+class TestResumableState(unittest.TestCase):
+    def setUp(self):
+        random = np.random.default_rng(0)
+        self.image = random.integers(0, 256, (48, 64, 3)).astype(np.uint8)
+        self.psf = kernel_gaussian(5, 1.0).kernel
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def save(self, name, rl):
+        file_path = os.path.join(self.folder.name, name)
+        save_state(file_path, rl.export_state())
+        return file_path
+
+    def test_resumed_run_is_identical_to_a_fresh_run(self):
+        rl = FastRichardsonLucy(self.image, self.psf, 5)
+        rl.apply()
+        file_path = self.save("state.npz", rl)
+
+        resumed_rl = FastRichardsonLucy(self.image, self.psf, 10)
+        state = find_resumable_state([file_path], 10, resumed_rl)
+        self.assertEqual(list(state["iterations"]), [5, 5, 5])
+
+        np.testing.assert_array_equal(
+            resumed_rl.apply(), FastRichardsonLucy(self.image, self.psf, 10).apply()
+        )
+
+    def test_incompatible_states_are_skipped(self):
+        other_rl = FastRichardsonLucy(255 - self.image, self.psf, 8)
+        other_rl.apply()
+        other_image_path = self.save("other_image.npz", other_rl)
+
+        other_psf_rl = FastRichardsonLucy(self.image, kernel_gaussian(5, 2.0).kernel, 8)
+        other_psf_rl.apply()
+        other_psf_path = self.save("other_psf.npz", other_psf_rl)
+
+        rl = FastRichardsonLucy(self.image, self.psf, 3)
+        rl.apply()
+        compatible_path = self.save("compatible.npz", rl)
+
+        resumed_rl = FastRichardsonLucy(self.image, self.psf, 10)
+        state = find_resumable_state(
+            [other_image_path, other_psf_path, compatible_path], 10, resumed_rl
+        )
+        self.assertEqual(list(state["iterations"]), [3, 3, 3])
+        self.assertEqual(list(resumed_rl.completed_iterations), [3, 3, 3])
+
+        self.assertIsNone(
+            find_resumable_state([other_image_path, other_psf_path], 10, resumed_rl)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,22 @@
+import unittest
+import numpy as np
+from image_processing.fft_backend import get_fft_backend, psf_to_otf
+from image_processing.kernels import kernel_gaussian
+
+
+class TestGaussianOTF(unittest.TestCase):
+    def test_analytic_otf_matches_the_kernel_matrix(self):
+        backend = get_fft_backend()
+        for size, sigma in [(3, 1.0), (5, 2.0), (11, 3.0)]:
+            kernel_obj = kernel_gaussian(size, sigma)
+            for shape in [(32, 32), (48, 64), (37, 51)]:
+                np.testing.assert_allclose(
+                    kernel_obj.otf(shape),
+                    psf_to_otf(kernel_obj.kernel, shape, backend),
+                    rtol=0,
+                    atol=1e-12,
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
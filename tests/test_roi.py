@@ -0,0 +1,86 @@
+import os
+import unittest
+import numpy as np
+from utils import load_image
+from image_processing.fast_richardson_lucy import FastRichardsonLucy
+from image_processing.fast_blind_richardson_lucy import FastBlindRichardsonLucy
+from image_processing.kernels import kernel_gaussian
+
+IMAGE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "images", "originals", "cheval.jpg"
+)
+
+
+class TestRegionsOfInterest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.image = load_image(IMAGE_PATH)
+        cls.psf = kernel_gaussian(5, 2.0).kernel
+        cls.box = (600, 400, 700, 470)
+        cls.full_run = FastRichardsonLucy(cls.image, cls.psf, 10)
+        cls.full_image = cls.full_run.apply()
+
+    def region(self, image):
+        left, upper, right, lower = self.box
+        return image[upper:lower, left:right]
+
+    def test_region_matches_full_frame_run(self):
+        deblurred_image = FastRichardsonLucy(self.image, self.psf, 10).apply_rois([self.box])
+
+        difference = np.abs(self.region(deblurred_image) - self.region(self.full_image))
+        self.assertLess(difference.mean(), 0.5)
+        self.assertLess(difference.max(), 3)
+
+    def test_region_with_full_frame_corrections_is_exact(self):
+        deblurred_image = FastRichardsonLucy(self.image, self.psf, 10).apply_rois(
+            [self.box], self.full_run.corrections
+        )
+
+        np.testing.assert_allclose(
+            self.region(deblurred_image), self.region(self.full_image), atol=1e-9
+        )
+
+    def test_outside_of_regions_is_untouched(self):
+        deblurred_image = FastRichardsonLucy(self.image, self.psf, 10).apply_rois([self.box])
+
+        left, upper, right, lower = self.box
+        outside = np.ones(self.image.shape[:2], dtype=bool)
+        outside[upper:lower, left:right] = False
+        np.testing.assert_array_equal(deblurred_image[outside], self.image[outside])
+
+
+class TestBlindRegionsOfInterest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.image = load_image(IMAGE_PATH)
+        cls.psf = kernel_gaussian(5, 2.0).kernel
+        cls.box = (600, 400, 700, 470)
+        cls.full_run = FastBlindRichardsonLucy(cls.image, cls.psf, 10, 5)
+        cls.full_image = cls.full_run.apply()
+
+    def region(self, image):
+        left, upper, right, lower = self.box
+        return image[upper:lower, left:right].astype(np.float64)
+
+    def test_region_matches_full_frame_run(self):
+        deblurred_image = FastBlindRichardsonLucy(self.image, self.psf, 10, 5).apply_rois(
+            [self.box]
+        )
+
+        difference = np.abs(self.region(deblurred_image) - self.region(self.full_image))
+        self.assertLess(difference.mean(), 0.5)
+        self.assertLessEqual(difference.max(), 5)
+
+    def test_region_with_full_frame_corrections_and_psfs_is_exact(self):
+        deblurred_image = FastBlindRichardsonLucy(self.image, self.psf, 10, 5).apply_rois(
+            [self.box], self.full_run.corrections, self.full_run.channel_psfs
+        )
+
+        # Floating-point rounding may only flip the truncation to uint8
+        np.testing.assert_allclose(
+            self.region(deblurred_image), self.region(self.full_image), atol=1
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,14 @@
 import numpy as np
 from PIL import Image
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from image_processing.kernels import scale_kernel
+from image_processing.shared_arrays import SharedArrayPool, attach
+from image_processing.memory_budget import MemoryBudgetScheduler, MemoryJob
 
 
-def load_image(image_path, grayscale=False):
+def load_image(image_path, grayscale=False, max_size=None):
     """
     Loads an image from a specified path and optionally converts it to grayscale.
 
@@ -11,17 +16,162 @@ def load_image(image_path, grayscale=False):
     :type image_path: str
     :param grayscale: Flag indicating whether to convert the image to grayscale. Default is False.
     :type grayscale: bool
+    :param max_size: Optional maximum width and height, for low-resolution previews. JPEG images are then decoded
+        directly at a reduced scale (1/2, 1/4 or 1/8, with Pillow's draft mode), which is much faster than
+        decoding them fully, and any other image is downscaled after decoding. Default is None (full resolution).
+    :type max_size: int
     :return: The loaded image as a NumPy array. If `grayscale` is True, the image will be 2D, otherwise 3D.
     :rtype: numpy.ndarray
     """
     image = Image.open(image_path)
-    if grayscale:
-        image = image.convert("L")
-    else:
-        image = image.convert("RGB")
+    mode = "L" if grayscale else "RGB"
+    if max_size is not None:
+        # Only reduces the decoding scale while the result stays at least max_size, no-op for other formats
+        image.draft(mode, (max_size, max_size))
+    image = image.convert(mode)
+    if max_size is not None and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
     return np.array(image)
 
 
+def image_size(image_path):
+    """
+    Reads the full-resolution size of an image from its header, without decoding it.
+
+    :param image_path: The path to the image.
+    :type image_path: str
+    :return: The (width, height) of the image.
+    :rtype: tuple
+    """
+    with Image.open(image_path) as image:
+        return image.size
+
+
+def load_preview(image_path, kernel_obj, max_size=256):
+    """
+    Loads a low-resolution version of an image for a preview, and scales a kernel to match it.
+
+    The resolution is never lowered so far that the blur of the scaled kernel becomes narrower than 2 pixels,
+    which spreads it over 3 pixels: a kernel shrunk to a single pixel leaves the image unchanged, and makes the
+    PSF estimation of a blind deconvolution a fixed identity. When that resolution is above `max_size`, e.g. for
+    3x3 kernels, a centered crop of `max_size` pixels is previewed at that resolution instead, so that the cost
+    of the preview stays the same. Both cases, and images already smaller than `max_size`, are reported.
+
+    :param image_path: The path to the image.
+    :type image_path: str
+    :param kernel_obj: The kernel at full resolution.
+    :type kernel_obj: Kernel
+    :param max_size: The maximum width and height of the preview. Default is 256.
+    :type max_size: int
+    :return: The image, as a 3D NumPy array, and the scaled kernel.
+    :rtype: tuple
+    """
+    full_width, full_height = image_size(image_path)
+    full_size = max(full_width, full_height)
+    min_size = math.ceil(2 * full_size / kernel_obj.size)
+
+    size = max_size
+    if full_size <= max_size:
+        print_yellow(
+            f"{os.path.basename(image_path)} is no larger than {max_size} pixels, previewing it at full resolution"
+        )
+    elif min_size > max_size:
+        size = min(min_size, full_size)
+        if size == full_size:
+            print_yellow(
+                f"{kernel_obj} cannot be previewed at a lower resolution, previewing a {max_size}-pixel crop "
+                f"at full resolution"
+            )
+        else:
+            print_yellow(
+                f"{kernel_obj} would shrink below 3 pixels at {max_size} pixels, previewing a {max_size}-pixel "
+                f"crop at {size} pixels"
+            )
+
+    image = load_image(image_path, max_size=size)
+    scale = image.shape[1] / full_width
+    if size > max_size:
+        top = max(0, (image.shape[0] - max_size) // 2)
+        left = max(0, (image.shape[1] - max_size) // 2)
+        image = image[top : top + max_size, left : left + max_size]
+    return image, scale_kernel(kernel_obj, scale)
+
+
+def process_folder_in_parallel(
+    input_folder, process, kernels, algorithm, workers, memory_budget=None
+):
+    """
+    Runs `process` on every image of a folder with every kernel, each pair in its own worker process. Each image
+    is decoded once into shared memory: workers only receive the name of the segment, never a pickled copy of the
+    image, and every segment is unlinked when the sweep ends, including when a worker crashed.
+
+    :param input_folder: The folder of the images.
+    :type input_folder: str
+    :param process: The function run in the workers, called as `process(image_path, kernel_obj, image=image)`,
+        e.g. a `functools.partial` of a bound method of the processor. Everything it needs must be picklable.
+    :type process: callable
+    :param kernels: The kernels (or initial PSFs), one job each per image.
+    :type kernels: list
+    :param algorithm: Either "richardson_lucy" or "blind_richardson_lucy", to estimate the footprint of the jobs.
+    :type algorithm: str
+    :param workers: Maximum number of concurrent jobs.
+    :type workers: int
+    :param memory_budget: Optional memory budget in bytes. Jobs then only run concurrently while their
+        estimated peaks fit in it (the shared images are outside of it), and each one reports its measured peak.
+        Default is None (no limit).
+    :type memory_budget: int
+    """
+    with SharedArrayPool() as pool:
+        jobs = []
+        for filename in os.listdir(input_folder):
+            if filename.endswith((".png", ".jpg", ".jpeg", ".webp", ".gif")):
+                print_blue(
+                    f"############### Processing image: {filename} ###############"
+                )
+                image_path = os.path.join(input_folder, filename)
+                image = load_image(image_path)
+                shared_image = pool.share(image)
+
+                for kernel in kernels:
+                    jobs.append(
+                        MemoryJob(
+                            f"{filename}, {kernel}",
+                            _process_shared_image,
+                            (process, image_path, kernel, shared_image),
+                            algorithm,
+                            image.shape,
+                            kernel.kernel.shape[0],
+                            image.dtype,
+                        )
+                    )
+
+        if memory_budget is not None:
+            scheduler = MemoryBudgetScheduler(memory_budget, workers)
+            scheduler.run(jobs, on_record=_print_memory_record)
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(job.function, *job.args) for job in jobs]
+            # Re-raises the first failure, e.g. a crashed worker, after which the pool unlinks every segment
+            for future in futures:
+                future.result()
+
+
+def _process_shared_image(process, image_path, kernel_obj, image):
+    # Runs in the worker process, on the shared image mapped without copying it
+    with attach(image) as shared_image:
+        process(image_path, kernel_obj, image=shared_image)
+
+
+def _print_memory_record(record):
+    resident_peak = record["resident_peak"]
+    resident = f"{resident_peak / 2**20:.1f} MiB" if resident_peak is not None else "unavailable"
+    print_yellow(
+        f"Memory of {record['name']}: estimated {record['estimate'] / 2**20:.1f} MiB, "
+        f"peak {record['peak'] / 2**20:.1f} MiB (tracemalloc), {resident} (resident)"
+    )
+
+
 def save_image(image_array, file_path):
     """
     Saves a NumPy array as an image to the specified path. The function handles normalization and ensures that the image data